@@ -0,0 +1,201 @@
+"""Benchmark the image processing stage on synthetic MidJourney-like images.
+
+Runs offline:
+
+    python -m benchmarks.bench_image_processing --output bench_results.json
+    python -m benchmarks.bench_image_processing --compare bench_results.json
+
+Each variant runs in its own process so peak RSS is measured per variant.
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+from PIL import Image, ImageFilter
+import PIL
+from utils.image_processor import process_images, peak_rss_mb
+from config.settings import OUTPUT_PROFILES, DERIVED_OUTPUT_PROFILES
+
+# Sizes and formats MidJourney actually delivers: split grid images, upscales and non-square aspect ratios
+IMAGE_SPECS = [
+    {"size": (1024, 1024), "format": "PNG", "mode": "RGB"},
+    {"size": (1024, 1024), "format": "PNG", "mode": "RGBA"},
+    {"size": (2048, 2048), "format": "PNG", "mode": "RGB"},
+    {"size": (1456, 816), "format": "PNG", "mode": "RGB"},
+    {"size": (896, 1344), "format": "PNG", "mode": "RGB"},
+    {"size": (1024, 1024), "format": "JPEG", "mode": "RGB"},
+    {"size": (1024, 1024), "format": "WEBP", "mode": "RGB"},
+]
+
+MASTER_PROFILE = OUTPUT_PROFILES[0]
+
+# name -> process_images keyword arguments
+VARIANTS = {
+    "sequential": {"workers": 1, "profiles": [MASTER_PROFILE]},
+    "parallel": {"workers": os.cpu_count() or 1, "profiles": [MASTER_PROFILE]},
+    "memory_bounded": {"workers": os.cpu_count() or 1, "memory_budget_mb": 512, "profiles": [MASTER_PROFILE]},
+    "encode_fast": {"workers": os.cpu_count() or 1, "profiles": [dict(MASTER_PROFILE, encode="fast")]},
+    "encode_balanced": {"workers": os.cpu_count() or 1, "profiles": [dict(MASTER_PROFILE, encode="balanced")]},
+    "encode_compact": {"workers": os.cpu_count() or 1, "profiles": [dict(MASTER_PROFILE, encode="compact")]},
+    "all_profiles": {"workers": os.cpu_count() or 1, "profiles": [MASTER_PROFILE, *DERIVED_OUTPUT_PROFILES]},
+}
+
+def generate_image(spec, seed):
+    """Smooth gradients, waves and fine grain, roughly how MidJourney art compresses"""
+    rng = np.random.default_rng(seed)
+    width, height = spec["size"]
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    x /= width
+    y /= height
+    freq = rng.uniform(3, 15, size=6)
+    phase = rng.uniform(0, np.pi * 2, size=3)
+    channels = [
+        np.sin(x * freq[0] + np.cos(y * freq[1]) * 2 + phase[0]),
+        np.cos(y * freq[2] + np.sin(x * freq[3]) * 3 + phase[1]),
+        np.sin((x + y) * freq[4] + np.cos(x * freq[5]) + phase[2]),
+    ]
+    pixels = np.stack([(c * 0.5 + 0.5) * 200 + 30 for c in channels], axis=-1)
+    pixels += rng.normal(0, 6, pixels.shape)
+    if spec["mode"] == "RGBA":
+        alpha = np.full((height, width, 1), 255, dtype=np.float32)
+        pixels = np.concatenate([pixels, alpha], axis=-1)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), spec["mode"])
+    return img.filter(ImageFilter.GaussianBlur(1))
+
+def generate_image_set(folder, count):
+    """Write `count` synthetic images cycling through IMAGE_SPECS"""
+    os.makedirs(folder, exist_ok=True)
+    extensions = {"PNG": ".png", "JPEG": ".jpeg", "WEBP": ".webp"}
+    for idx in range(count):
+        spec = IMAGE_SPECS[idx % len(IMAGE_SPECS)]
+        img = generate_image(spec, seed=idx)
+        path = os.path.join(folder, f"synthetic_{idx:03d}{extensions[spec['format']]}")
+        if spec["format"] == "JPEG":
+            img.save(path, format="JPEG", quality=90)
+        elif spec["format"] == "WEBP":
+            img.save(path, format="WEBP", quality=90)
+        else:
+            img.save(path, format="PNG")
+        # Keep ctime order stable so every variant picks the same files
+        time.sleep(0.01)
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+def folder_bytes(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+def run_variant(name, raw_folder, work_folder, queue):
+    """Run one variant and put its metrics on the queue. Runs in a fresh process."""
+    target_folder = os.path.join(work_folder, name)
+    kwargs = dict(VARIANTS[name], use_cache=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        results = process_images(raw_folder, target_folder, **kwargs)
+        wall_seconds = time.perf_counter() - start_time
+
+    latencies = [r["elapsed"] for r in results if r["success"]]
+    worker_peaks = {}
+    for r in results:
+        if r.get("peak_rss_mb") is not None:
+            worker_peaks[r["pid"]] = max(worker_peaks.get(r["pid"], 0), r["peak_rss_mb"])
+
+    queue.put({
+        "variant": name,
+        "workers": kwargs.get("workers"),
+        "profiles": [p["name"] for p in kwargs["profiles"]],
+        "encode": [p.get("encode") for p in kwargs["profiles"]],
+        "memory_budget_mb": kwargs.get("memory_budget_mb"),
+        "images": len(results),
+        "failed": len(results) - len(latencies),
+        "wall_seconds": wall_seconds,
+        "images_per_sec": len(latencies) / wall_seconds if wall_seconds else None,
+        "p50_seconds": percentile(latencies, 50),
+        "p95_seconds": percentile(latencies, 95),
+        # The variant's own process, plus the largest and summed worker peaks when a pool was used
+        "peak_rss_mb": peak_rss_mb(),
+        "worker_peak_rss_mb": max(worker_peaks.values()) if worker_peaks else None,
+        "workers_total_peak_rss_mb": sum(worker_peaks.values()) if worker_peaks else None,
+        "output_bytes": folder_bytes(target_folder),
+    })
+
+def compare(current, previous):
+    """Print images/sec and p95 changes against an earlier results file"""
+    previous_by_name = {v["variant"]: v for v in previous["variants"]}
+    print(f"\n{'variant':<16} {'img/s':>8} {'prev':>8} {'change':>8} {'p95 s':>8} {'prev':>8}")
+    for variant in current["variants"]:
+        before = previous_by_name.get(variant["variant"])
+        if not before or not before["images_per_sec"]:
+            continue
+        change = (variant["images_per_sec"] / before["images_per_sec"] - 1) * 100
+        print(f"{variant['variant']:<16} {variant['images_per_sec']:>8.2f} {before['images_per_sec']:>8.2f} "
+              f"{change:>+7.1f}% {variant['p95_seconds']:>8.2f} {before['p95_seconds']:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_images on synthetic images")
+    parser.add_argument("--images", type=int, default=len(IMAGE_SPECS) * 2, help="Number of synthetic images")
+    parser.add_argument("--variants", nargs="+", choices=sorted(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated images and outputs")
+    args = parser.parse_args()
+
+    work_folder = tempfile.mkdtemp(prefix="bench_image_processing_")
+    raw_folder = os.path.join(work_folder, "raw")
+    print(f"🧪 Generating {args.images} synthetic images in {raw_folder}")
+    generate_image_set(raw_folder, args.images)
+
+    # Spawn so every variant starts from a clean process and its peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    variants = []
+    try:
+        for name in args.variants:
+            print(f"⏱️ Running {name}...")
+            queue = context.Queue()
+            process = context.Process(target=run_variant, args=(name, raw_folder, work_folder, queue))
+            process.start()
+            metrics = queue.get()
+            process.join()
+            variants.append(metrics)
+            print(f"   {metrics['images_per_sec']:.2f} img/s, p50 {metrics['p50_seconds']:.2f}s, "
+                  f"p95 {metrics['p95_seconds']:.2f}s, {metrics['output_bytes'] / (1024 * 1024):.1f} MB out")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "images": args.images,
+        "image_specs": IMAGE_SPECS,
+        "variants": variants,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
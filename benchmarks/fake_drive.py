@@ -0,0 +1,258 @@
+"""Upload products to a local fake Drive server and count the HTTP calls.
+
+Runs offline:
+
+    python -m benchmarks.fake_drive
+    python -m benchmarks.fake_drive --products 3 --images 8 --drop 2
+
+services.google_drive is pointed at the fake through DRIVE_API_ROOT and
+used through a real pydrive instance with a made-up access token, so
+folder lookups, batches, permissions and pydrive's resumable uploads all
+reach the server. The server keeps its files in memory and answers the
+few Drive v2 calls the uploader makes.
+
+--drop makes the server finish that many uploads without ever answering
+them, the ambiguous failure where the file exists but the client saw an
+error. Each product is uploaded twice, the second time into the folder
+the first run created, and the check is that no folder or file ends up
+duplicated.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import email
+import shutil
+import argparse
+import tempfile
+import threading
+import http.server
+from urllib.parse import urlparse, parse_qs
+from config.settings import DIGITAL_PAPER_FOLDER
+import services.google_drive as google_drive
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+class FakeDrive:
+    """Drive v2 files, permissions and upload sessions, in memory"""
+
+    def __init__(self, drop_uploads=0):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.sessions = {}
+        self.calls = []
+        self.drop_uploads = drop_uploads
+
+    def matches(self, item, query):
+        for title in re.findall(r"title='((?:[^'\\]|\\.)*)'", query):
+            if item['title'] != re.sub(r"\\(.)", r"\1", title):
+                return False
+        for mime_type in re.findall(r"mimeType='([^']*)'", query):
+            if item['mimeType'] != mime_type:
+                return False
+        for parent_id in re.findall(r"'([^']+)' in parents", query):
+            if not any(parent['id'] == parent_id for parent in item['parents']):
+                return False
+        return True
+
+    def create(self, metadata):
+        item = {
+            'id': uuid.uuid4().hex[:12],
+            'title': metadata['title'],
+            'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+            'parents': metadata.get('parents', []),
+            'permissions': [{'type': 'user', 'role': 'owner'}],
+        }
+        self.files[item['id']] = item
+        return item
+
+    def handle(self, method, path, query, body):
+        """One API call, as (status, JSON response)"""
+        if method == 'GET' and path == '/drive/v2/files':
+            q = query.get('q', [''])[0]
+            items = [item for item in self.files.values() if self.matches(item, q)]
+            max_results = int(query.get('maxResults', [0])[0])
+            return 200, {'items': items[:max_results] if max_results else items}
+        if method == 'POST' and path == '/drive/v2/files':
+            return 200, self.create(json.loads(body))
+        match = re.fullmatch(r'/drive/v2/files/([^/]+)/permissions', path)
+        if method == 'POST' and match and match.group(1) in self.files:
+            permission = json.loads(body)
+            self.files[match.group(1)]['permissions'].append(permission)
+            return 200, dict(permission, id='anyoneWithLink')
+        return 404, {'error': {'code': 404, 'message': f"{method} {path} not found"}}
+
+def serve(fake):
+    """Serve `fake` on a free local port"""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, obj, headers=None):
+            body = json.dumps(obj).encode('utf-8') if obj is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._route('GET')
+
+        def do_POST(self):
+            self._route('POST')
+
+        def do_PUT(self):
+            self._route('PUT')
+
+        def _route(self, method):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            with fake.lock:
+                fake.calls.append((method, url.path))
+            # httplib2 resends a streamed upload body it already used up as nothing, give up on it like Drive does
+            self.connection.settimeout(2)
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            except TimeoutError:
+                self.close_connection = True
+                return
+            self.connection.settimeout(None)
+            if url.path == '/batch/drive/v2':
+                self._batch(body)
+            elif url.path == '/upload/drive/v2/files':
+                self._upload(method, query, body)
+            else:
+                with fake.lock:
+                    status, obj = fake.handle(method, url.path, query, body)
+                self._send(status, obj)
+
+        def _batch(self, body):
+            message = email.message_from_bytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode('ascii') + b'\r\n\r\n' + body
+            )
+            boundary = uuid.uuid4().hex
+            parts = []
+            for part in message.get_payload():
+                request = part.get_payload()
+                head, _, part_body = request.partition('\r\n\r\n') if '\r\n\r\n' in request else request.partition('\n\n')
+                method, url, _ = head.splitlines()[0].split(' ')
+                url = urlparse(url)
+                with fake.lock:
+                    status, obj = fake.handle(method, url.path, parse_qs(url.query), part_body)
+                content_id = part['Content-ID'].strip('<>')
+                parts.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                             f"Content-ID: <response-{content_id}>\r\n\r\n"
+                             f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n"
+                             f"{json.dumps(obj)}\r\n")
+            data = (''.join(parts) + f"--{boundary}--\r\n").encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', f'multipart/mixed; boundary={boundary}')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _upload(self, method, query, body):
+            if method == 'POST' and query.get('uploadType') == ['resumable']:
+                # Start a session, the content follows in a PUT to its Location
+                session_id = uuid.uuid4().hex
+                with fake.lock:
+                    fake.sessions[session_id] = {'metadata': json.loads(body or b'{}'), 'file': None}
+                location = f"http://{self.headers['Host']}/upload/drive/v2/files?upload_id={session_id}"
+                self._send(200, None, {'Location': location})
+                return
+            session_id = query.get('upload_id', [''])[0]
+            with fake.lock:
+                session = fake.sessions.get(session_id)
+                if session is None:
+                    status, obj, drop = 404, {'error': {'code': 404, 'message': 'no such upload'}}, False
+                else:
+                    if session['file'] is None:
+                        session['file'] = fake.create(session['metadata'])
+                        session['drop'] = fake.drop_uploads > 0
+                        fake.drop_uploads -= session['drop']
+                    status, obj, drop = 200, session['file'], session['drop']
+            if drop:
+                # The file is stored but the client never hears back
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self._send(status, obj)
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def fake_pydrive():
+    """A real pydrive instance with a made-up access token"""
+    from pydrive.auth import GoogleAuth
+    from pydrive.drive import GoogleDrive
+    from oauth2client.client import AccessTokenCredentials
+
+    gauth = GoogleAuth()
+    gauth.credentials = AccessTokenCredentials('fake-token', 'fake-drive')
+    gauth.Authorize()
+    return GoogleDrive(gauth)
+
+def make_product(root, idx, images):
+    folder = os.path.join(root, DIGITAL_PAPER_FOLDER, f"Fake Product {idx} - Digital Paper")
+    os.makedirs(folder, exist_ok=True)
+    for image_idx in range(images):
+        with open(os.path.join(folder, f"image_{image_idx}.png"), 'wb') as f:
+            f.write(os.urandom(2048))
+    return folder
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload products to a local fake Drive server")
+    parser.add_argument("--products", type=int, default=2)
+    parser.add_argument("--images", type=int, default=6, help="Images per product")
+    parser.add_argument("--drop", type=int, default=1, help="Uploads the server finishes without answering")
+    args = parser.parse_args()
+
+    fake = FakeDrive(drop_uploads=args.drop)
+    server = serve(fake)
+    google_drive.DRIVE_API_ROOT = f"http://127.0.0.1:{server.server_port}/"
+    google_drive.set_google_drive_instance(fake_pydrive())
+    root = tempfile.mkdtemp(prefix="fake_drive_")
+    ok = True
+    try:
+        for idx in range(args.products):
+            folder = make_product(root, idx, args.images)
+            for run in ("first upload", "rerun"):
+                with fake.lock:
+                    fake.calls.clear()
+                start_time = time.monotonic()
+                result = google_drive.upload_to_google_drive(folder, expected_count=args.images)
+                with fake.lock:
+                    calls = list(fake.calls)
+                uploads = sum(1 for _, path in calls if path.startswith('/upload/'))
+                print(f"🧪 Product {idx}, {run}: {len(calls)} HTTP calls, {uploads} of them uploads, "
+                      f"{len(calls) - uploads} other, {time.monotonic() - start_time:.2f}s")
+                if not result or len(result['file_links']) != args.images:
+                    print(f"❌ Expected {args.images} file links, got {result}")
+                    ok = False
+        # A rerun uploads its files again, so only folders and the first run's files are checked
+        folders = [item for item in fake.files.values() if item['mimeType'] == FOLDER_MIME_TYPE]
+        folder_titles = [item['title'] for item in folders]
+        if len(folder_titles) != len(set(folder_titles)):
+            print(f"❌ Duplicate folders: {sorted(folder_titles)}")
+            ok = False
+        files = len(fake.files) - len(folders)
+        if files != args.products * args.images * 2:
+            print(f"❌ Expected {args.products * args.images * 2} files after two runs, found {files}")
+            ok = False
+        if ok:
+            print(f"✅ {len(folders)} folders and {files} files, dropped uploads weren't duplicated")
+        return 0 if ok else 1
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
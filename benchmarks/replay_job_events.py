@@ -0,0 +1,258 @@
+"""Drive JobTracker with fake MidJourney job events.
+
+Runs offline:
+
+    python -m benchmarks.replay_job_events
+    python -m benchmarks.replay_job_events --jobs 8 --failed 2 --interval 0.05
+    python -m benchmarks.replay_job_events --recording frames.txt --expected 4
+    python -m benchmarks.replay_job_events --browser
+
+The synthetic stream mixes what the web app sends: Socket.IO frames and
+plain JSON bodies, archive jobs that arrive already finished, other
+prompts' jobs, failures and late out-of-order updates. A recording is one
+WebSocket frame or response body per line, replayed in order.
+
+Without --browser the frames are fed to the tracker directly. With it a
+local stand-in page receives them, once over a WebSocket and once as
+fetched job status responses, in a headless browser the tracker is
+attached to, so the CDP wiring in JobTracker.attach is exercised too.
+"""
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import http.server
+from urllib.parse import urlparse
+from services.midjourney.job_tracker import JobTracker
+
+PROMPT = "seamless watercolor lemons, pastel background"
+
+def job_id(seed, idx):
+    return f"{seed:08x}-0000-4000-8000-{idx:012x}"
+
+def socketio_frame(event, payload):
+    return f'42{json.dumps([event, payload])}'
+
+def synthetic_frames(jobs, failed, seed):
+    """(frames, ids expected to finish) for `jobs` jobs of PROMPT, `failed` of which fail"""
+    rng = random.Random(seed)
+    ids = [job_id(seed, idx) for idx in range(jobs)]
+    frames = []
+    # The archive page reloading older jobs, already finished, and another prompt's job running
+    frames.append(json.dumps({"jobs": [{"id": job_id(seed + 1, idx), "status": "completed",
+                                        "prompt": PROMPT} for idx in range(3)]}))
+    frames.append(socketio_frame("job_update", {"job": {"id": job_id(seed + 2, 0), "status": "running",
+                                                        "progress": 5, "prompt": "something else"}}))
+    for idx in ids:
+        frames.append(socketio_frame("job_update", {"job": {"id": idx, "status": "running", "progress": 0,
+                                                            "full_command": f"{PROMPT} --ar 1:1 --v 6"}}))
+    progress = [socketio_frame("job_update", {"job": {"id": idx, "progress": pct}})
+                for idx in ids for pct in (25, 50, 75)]
+    rng.shuffle(progress)
+    frames.extend(progress)
+    outcomes = ids[:]
+    rng.shuffle(outcomes)
+    failed_ids = set(outcomes[:failed])
+    for idx in outcomes:
+        status = "failed" if idx in failed_ids else "completed"
+        frames.append(socketio_frame("job_update", {"job": {"id": idx, "status": status}}))
+    # A stale progress update after completion must not reopen the job
+    frames.append(socketio_frame("job_update", {"job": {"id": ids[-1], "status": "running", "progress": 75}}))
+    frames.append("3")  # Socket.IO pong, ignored
+    return frames, [idx for idx in ids if idx not in failed_ids]
+
+def emit(tracker, frames, interval, emitted):
+    for frame in frames:
+        time.sleep(interval)
+        tracker.feed_text(frame)
+    emitted['at'] = time.monotonic()
+
+# Receives a round's frames over a WebSocket, or fetches them one response at a time
+STAND_IN_PAGE = """<!doctype html>
+<html><head><title>Job events stand-in</title></head><body>
+<script>
+const params = new URLSearchParams(location.search);
+const round = params.get('round');
+const interval = parseFloat(params.get('interval')) * 1000;
+if (params.get('transport') === 'ws') {
+    const socket = new WebSocket(`ws://${location.host}/ws/${round}`);
+    socket.onmessage = () => {};
+} else {
+    (async () => {
+        while ((await (await fetch(`/midjourney.com/api/job-status/${round}`)).text()) !== '') {
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    })();
+}
+</script>
+</body></html>
+"""
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+def websocket_text_frame(text):
+    """An unmasked server-to-client text frame"""
+    payload = text.encode('utf-8')
+    if len(payload) < 126:
+        header = bytes([0x81, len(payload)])
+    elif len(payload) < 65536:
+        header = bytes([0x81, 126]) + len(payload).to_bytes(2, 'big')
+    else:
+        header = bytes([0x81, 127]) + len(payload).to_bytes(8, 'big')
+    return header + payload
+
+def serve_stand_in(rounds, interval):
+    """Serve the stand-in page on a free local port. `rounds` maps round names to their frames."""
+    pending = {name: list(frames) for name, frames in rounds.items()}
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type):
+            body = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/':
+                self._send(200, STAND_IN_PAGE, 'text/html')
+            elif path.startswith('/ws/'):
+                self._stream_websocket(path.rpartition('/')[2])
+            elif path.startswith('/midjourney.com/api/job-status/'):
+                # Under a path JOB_STATUS_URL_PATTERN matches, so the tracker reads these bodies
+                with lock:
+                    frames = pending.get(path.rpartition('/')[2]) or []
+                    frame = frames.pop(0) if frames else ''
+                self._send(200, frame, 'application/json')
+            else:
+                self._send(404, 'not found', 'text/plain')
+
+        def _stream_websocket(self, name):
+            accept = base64.b64encode(
+                hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).encode('ascii')).digest()
+            ).decode('ascii')
+            self.send_response(101)
+            self.send_header('Upgrade', 'websocket')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Sec-WebSocket-Accept', accept)
+            self.end_headers()
+            with lock:
+                frames, pending[name] = pending.get(name) or [], []
+            for frame in frames:
+                time.sleep(interval)
+                self.wfile.write(websocket_text_frame(frame))
+                self.wfile.flush()
+            self.wfile.write(bytes([0x88, 0]))  # Close
+            self.close_connection = True
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def check_finished(tracker, finished, expected_ids):
+    """Print and check what wait_for_jobs returned. Returns whether it matched."""
+    if finished is None:
+        print("❌ No job events recognised")
+        return False
+    print(f"Finished jobs, newest first: {finished}")
+    if expected_ids is None:
+        return True
+    if sorted(finished) != sorted(expected_ids):
+        print(f"❌ Expected {sorted(expected_ids)}")
+        return False
+    reopened = [idx for idx in finished if not tracker.jobs[idx]['done']]
+    if reopened:
+        print(f"❌ Jobs reopened by a late update: {reopened}")
+        return False
+    print(f"✅ Tracker matched the {len(expected_ids)} finished jobs, "
+          f"ignoring archive, failed and other prompts' jobs")
+    return True
+
+def run_in_browser(args):
+    """Replay a synthetic round over each transport through the stand-in page and a real browser"""
+    from botasaurus.browser import Driver
+
+    rounds = {}
+    expected = {}
+    for offset, transport in enumerate(('ws', 'fetch')):
+        rounds[transport], expected[transport] = synthetic_frames(args.jobs, args.failed, args.seed + offset * 16)
+    server = serve_stand_in(rounds, args.interval)
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+    # Start on a blank tab, chrome-headless-shell doesn't open one by itself
+    driver = Driver(headless=True, chrome_executable_path=args.chrome, arguments=['about:blank'])
+    try:
+        # Like the archive page in a real run, a page is open before the tracker attaches to its tab
+        driver.get(base_url)
+        tracker = JobTracker().attach(driver)
+        ok = True
+        for transport in ('ws', 'fetch'):
+            mark = tracker.mark()
+            print(f"🧪 Opening the stand-in page, {len(rounds[transport])} frames over {transport}")
+            start_time = time.monotonic()
+            driver.get(f"{base_url}?transport={transport}&round={transport}&interval={args.interval}")
+            finished = tracker.wait_for_jobs(mark, args.jobs, prompts=[PROMPT], timeout=args.timeout,
+                                             silence_timeout=max(5.0, args.interval * 20))
+            print(f"Returned {time.monotonic() - start_time:.2f}s after opening the page")
+            # Let the stale update arrive before checking nothing was reopened
+            time.sleep(args.interval * 5 + 1)
+            ok = check_finished(tracker, finished, expected[transport]) and ok
+        return 0 if ok else 1
+    finally:
+        driver.close()
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay fake job events into a JobTracker")
+    parser.add_argument("--jobs", type=int, default=4, help="Jobs in the synthetic stream")
+    parser.add_argument("--failed", type=int, default=1, help="How many of them fail")
+    parser.add_argument("--interval", type=float, default=0.02, help="Seconds between frames")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--recording", help="File of recorded frames, one per line, instead of the synthetic stream")
+    parser.add_argument("--expected", type=int, help="Jobs to wait for when replaying a recording")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--browser", action="store_true",
+                        help="Send the frames through a local stand-in page in a headless browser")
+    parser.add_argument("--chrome", help="Chrome executable for --browser, when it isn't found by itself")
+    args = parser.parse_args()
+
+    if args.browser:
+        return run_in_browser(args)
+
+    if args.recording:
+        with open(args.recording, encoding='utf-8') as f:
+            frames = [line.rstrip('\n') for line in f if line.strip()]
+        expected_ids = None
+        expected_jobs = args.expected or 4
+        prompts = None
+    else:
+        frames, expected_ids = synthetic_frames(args.jobs, args.failed, args.seed)
+        expected_jobs = args.jobs
+        prompts = [PROMPT]
+
+    tracker = JobTracker()
+    mark = tracker.mark()
+    emitted = {}
+    emitter = threading.Thread(target=emit, args=(tracker, frames, args.interval, emitted), daemon=True)
+    print(f"🧪 Replaying {len(frames)} frames, waiting for {expected_jobs} jobs")
+    start_time = time.monotonic()
+    emitter.start()
+    finished = tracker.wait_for_jobs(mark, expected_jobs, prompts=prompts, timeout=args.timeout,
+                                     silence_timeout=max(1.0, args.interval * 10))
+    print(f"Returned {time.monotonic() - start_time:.2f}s after the first frame")
+    emitter.join()
+    return 0 if check_finished(tracker, finished, expected_ids) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -50,9 +50,146 @@ INPUT_EXCEL_FILE = os.path.join(DOWNLOADS_FOLDER, "template (4).xlsx")
 
 # Script Settings
 NUMBER_OF_PROMPTS_PER_PRODUCT = 10
-WAIT_TIME_BETWEEN_PROMPTS = 3
-WAIT_BETWEEN_IMAGE_CHECKS = 45
-MAX_IMAGE_WAIT_TIME = 900
+WAIT_TIME_BETWEEN_PROMPTS = 3  # Starting gap between prompts, RATE_LIMITS["prompts"] adapts it from there
+WAIT_BETWEEN_IMAGE_CHECKS = 45  # Longest gap between generation checks once nothing is changing
+MAX_IMAGE_WAIT_TIME = 900  # Give up on a product's jobs after this many seconds
+GENERATION_FIRST_CHECK_DELAY = 20  # Jobs never finish sooner than this
+GENERATION_MIN_CHECK_INTERVAL = 3  # Gap between checks right after a job finishes
+GENERATION_BACKOFF = 1.5  # Growth of the gap between checks while nothing changes
+# "dom" polls the archive page, "network" follows the web app's own job updates over CDP
+# and falls back to polling if none are seen within JOB_TRACKING_SILENCE_TIMEOUT seconds
+JOB_TRACKING_MODE = "dom"
+JOB_STATUS_URL_PATTERN = r"midjourney\.com/api/.*(job|imagine|submit|queue)"
+JOB_TRACKING_SILENCE_TIMEOUT = 60
+
+# Pipelined Scheduling - prompts for the next products are submitted while earlier products
+# generate, download, process and upload, keeping at most PIPELINE_MAX_JOBS_IN_FLIGHT jobs
+# unfinished on MidJourney (your plan's concurrent plus queued job limit)
+PIPELINE_ENABLED = True
+PIPELINE_MAX_JOBS_IN_FLIGHT = 10
+PIPELINE_FINISH_WORKERS = 1  # Products downloaded, processed and uploaded at once
+
+# Browser Workers - one browser session per entry, all pulling products from the same workbook.
+# Each entry is a botasaurus profile name logged into its own MidJourney account, None uses a
+# fresh profile. e.g. ["midjourney-account-1", "midjourney-account-2"]
+BROWSER_PROFILES = [None]
+
+# Rate Limits - actions per second. Each limit speeds up by "increase" after every action the
+# site accepts, up to "max_rate", and halves ("decrease") on errors, verification pages or
+# rejected prompts, down to "min_rate". "burst" actions may start back to back after a pause.
+# Prompt and navigation limits are kept per browser session, download limits are shared.
+RATE_LIMITS = {
+    "prompts": {"rate": 1 / WAIT_TIME_BETWEEN_PROMPTS, "min_rate": 1 / 30, "max_rate": 1.0,
+                "burst": 1, "increase": 0.05, "decrease": 0.5},
+    "navigation": {"rate": 0.5, "min_rate": 1 / 30, "max_rate": 2.0, "burst": 2, "increase": 0.1, "decrease": 0.5},
+    "downloads": {"rate": 20.0, "min_rate": 1.0, "max_rate": 50.0, "burst": 8, "increase": 1.0, "decrease": 0.5},
+}
+PROMPT_BATCH_SUBMIT = True  # Submit a product's prompts in one in-page script instead of typing each one
+PROMPT_ACCEPT_TIMEOUT = 5  # Seconds for the prompt box to clear after submitting before the prompt counts as rejected
+
+# Image Processing Settings
+IMAGE_PROCESS_WORKERS = os.cpu_count() or 1  # Set to 1 to process images one at a time
+IMAGE_PROCESS_MEMORY_BUDGET_MB = None  # e.g. 1024 to cap how many full-size image buffers are alive at once
+
+# Output Profiles - every raw image is decoded once and each profile is derived,
+# largest first, from that decode or from the previous larger derivative.
+# "format": None keeps the raw file's format, "folder": None writes into the product folder itself
+# "encode" names one of ENCODE_PROFILES, None uses ENCODE_PROFILE
+OUTPUT_PROFILES = [
+    {"name": "master", "size": (3600, 3600), "dpi": (300, 300), "format": None, "quality": 95, "folder": None, "encode": None},
+]
+# Downscaled copies for the web, listing previews and thumbnails, each one more encode per image.
+# Off by default, to also write them: OUTPUT_PROFILES = [*OUTPUT_PROFILES, *DERIVED_OUTPUT_PROFILES]
+DERIVED_OUTPUT_PROFILES = [
+    {"name": "web", "size": (2000, 2000), "dpi": (72, 72), "format": "PNG", "quality": 95, "folder": "Web", "encode": "balanced"},
+    {"name": "preview", "size": (1200, 1200), "dpi": (72, 72), "format": "JPEG", "quality": 85, "folder": "Preview", "encode": "balanced"},
+    {"name": "thumbnail", "size": (600, 600), "dpi": (72, 72), "format": "JPEG", "quality": 80, "folder": "Thumbnails", "encode": "balanced"},
+]
+
+# Encode Profiles - how outputs are written. "lossless_format" decides whether PNG outputs
+# are written as PNG or as lossless WebP. Measure them on your own images with
+# utils.image_processor.measure_encode_profiles(sample_path).
+# Measured on a synthetic 1024px MidJourney-style PNG upscaled to 3600x3600, one core:
+#   profile    format  seconds     MB
+#   archival   PNG       57.08   4.58
+#   archival   JPEG       0.14   1.24
+#   balanced   PNG        4.50   5.12
+#   balanced   JPEG       0.33   1.22
+#   fast       PNG        1.34   6.96
+#   fast       JPEG       0.06   1.30
+#   compact    WEBP      11.32   3.84
+#   compact    JPEG       0.39   1.86
+ENCODE_PROFILES = {
+    "archival": {
+        "lossless_format": "PNG", "png_compress_level": 9, "png_optimize": True, "webp_method": 6,
+        "jpeg_subsampling": "4:2:0", "jpeg_progressive": False, "jpeg_optimize": True
+    },
+    "balanced": {
+        "lossless_format": "PNG", "png_compress_level": 6, "png_optimize": False, "webp_method": 4,
+        "jpeg_subsampling": "4:2:0", "jpeg_progressive": True, "jpeg_optimize": True
+    },
+    "fast": {
+        "lossless_format": "PNG", "png_compress_level": 1, "png_optimize": False, "webp_method": 0,
+        "jpeg_subsampling": "4:2:0", "jpeg_progressive": False, "jpeg_optimize": False
+    },
+    "compact": {
+        "lossless_format": "WEBP", "png_compress_level": 9, "png_optimize": True, "webp_method": 4,
+        "jpeg_subsampling": "4:4:4", "jpeg_progressive": True, "jpeg_optimize": True
+    },
+}
+# "balanced" writes PNGs with the same pixels as "archival" (the original optimize=True output)
+# about 12x faster and about 12% larger. Use "archival" for the smallest files, ~57 s per image.
+ENCODE_PROFILE = "balanced"
+
+# Seamless Pattern Check - images whose opposite edges don't wrap are skipped before
+# processing and upload. The score is ~1 for a clean wrap and grows with the seam.
+SEAM_CHECK_ENABLED = True
+SEAM_CHECK_SIZE = 256
+SEAM_CHECK_MAX_SCORE = 2.5
+
+# Near-Duplicate Check - raw images within DEDUP_MAX_DISTANCE bits (of 64) of an image
+# already downloaded, in this or an earlier run, are skipped before processing and upload
+DEDUP_ENABLED = True
+DEDUP_MAX_DISTANCE = 6
+PHASH_INDEX_FILE = os.path.join(DATA_ROOT, "phash_index.json")
+
+# Listing Images - built from the downscaled LISTING_SOURCE_PROFILE outputs when that profile
+# is in OUTPUT_PROFILES (see DERIVED_OUTPUT_PROFILES), otherwise from the masters
+LISTING_IMAGES_FOLDER = os.path.join(DATA_ROOT, "Digital Paper Store - Listing Images")
+LISTING_SOURCE_PROFILE = "preview"
+LISTING_IMAGE_SIZE = (2000, 2000)
+LISTING_WATERMARK_TEXT = "Digital Paper Store"
+LISTING_WORKERS = IMAGE_PROCESS_WORKERS
+
+# Processed Output Cache Settings
+PROCESSED_CACHE_ENABLED = True  # Reuse outputs already made from identical raw bytes and profiles instead of re-encoding
+PROCESSED_CACHE_FOLDER = os.path.join(DATA_ROOT, "Digital Paper Store - Processed Cache")
+PROCESSED_CACHE_MAX_MB = 10 * 1024
+
+# Download Settings
+DOWNLOAD_TIMEOUT = 60  # Seconds per connect or read
+DOWNLOAD_POOL_SIZE = 8  # Idle keep-alive connections kept per host
+DOWNLOAD_MAX_RETRIES = 5  # Failed attempts are kept as .part files and resumed with a Range request
+DOWNLOAD_CONCURRENCY = 8  # Images downloaded at once
+DOWNLOAD_PER_HOST_LIMIT = 6  # Images downloaded at once from any one host
+HARVEST_IMAGE_URLS = True  # Read all image URLs from the archive grid at once instead of opening each image
+DOWNLOAD_HANDOFF_BUFFERS = True  # Keep downloaded bytes in memory for processing instead of re-reading the raw files
+DOWNLOAD_INDEX_DB = os.path.join(DATA_ROOT, "download_index.sqlite3")  # Every image downloaded so far, by job id and index
+
+# Google Drive Upload Settings
+DRIVE_UPLOAD_WORKERS = 4  # Files uploaded at once, each thread with its own authorized client
+DRIVE_UPLOAD_RETRIES = 3  # Attempts per file
+# Files are reachable through the product folder's "anyone with the link" share. Set to False
+# to also give every file its own permission (sent in batches), e.g. for shared drives.
+DRIVE_INHERIT_SHARING = True
+# Every Drive call, uploads and batches included, goes under this root. Point it at a local
+# fake Drive server to test, see benchmarks/fake_drive.py
+DRIVE_API_ROOT = "https://www.googleapis.com/"
+DRIVE_BATCH_SIZE = 100  # Most requests Drive accepts in one batch call
+
+# Product Ledger - the last stage each product completed, so a restart resumes it there
+# instead of submitting its prompts again. Delete a product's row to redo it from scratch.
+PRODUCT_LEDGER_DB = os.path.join(DATA_ROOT, "product_ledger.sqlite3")
 
 # URLs
 ORGANIZE_PAGE_URL = "https://www.midjourney.com/archive"
@@ -1,19 +1,139 @@
-import time
 import logging
 import os
+import queue
+import threading
 import openpyxl
-from services.midjourney.process import update_excel_with_results
+from services.midjourney.process import record_product_result, record_product_failure, product_ledger_entry
 from utils.excel import read_prompts_from_excel
-from services.midjourney import process_product
+from services.midjourney import process_product, PipelineScheduler
+from services.midjourney.job_tracker import get_job_tracker
+from utils.ledger import get_product_ledger, stage_reached
+from utils.rate_limiter import get_rate_limiter, rate_limiters
 from services.google_drive import init_google_drive, set_google_drive_instance
-from config.settings import INPUT_EXCEL_FILE  # Import from settings
+from config.settings import INPUT_EXCEL_FILE, PIPELINE_ENABLED, JOB_TRACKING_MODE, BROWSER_PROFILES  # Import from settings
 from botasaurus.browser import browser, Driver
 # Constants
 BACKUP_FOLDER = "backups"
 
-@browser
-def process_all_products(driver: Driver, data):
-    """Process all products sequentially"""
+def product_record(product_data):
+    """The fields of an input row carried through processing into the results sheet"""
+    return {
+        'Product Name': product_data.get('Product Name', 'Untitled Product'),
+        'Product Type': product_data.get('Product Type', 'Unknown Type'),
+        'Category': product_data.get('Category', 'Uncategorized'),
+        'Theme': product_data.get('Theme', 'No Theme'),
+        'Prompts': product_data.get('Prompts', []),
+        'Title': product_data.get('Title', ''),
+        'Hook': product_data.get('Hook', ''),
+        'Premade Description': product_data.get('Premade Description', ''),
+        'Full Description': product_data.get('Full Description', '')
+    }
+
+# Shared by the browser workers: products not yet claimed, one console, and a stop flag
+_products_queue = queue.Queue()
+_console_lock = threading.Lock()
+_stop_requested = threading.Event()
+
+def claim_products(summary):
+    """Take (idx, product_data) pairs off the shared queue until it's empty or a stop was requested.
+
+    Each product is handed to exactly one worker, and counted in the
+    worker's `summary` as taken.
+    """
+    while not _stop_requested.is_set():
+        try:
+            product = _products_queue.get_nowait()
+        except queue.Empty:
+            return
+        summary['taken'] += 1
+        yield product
+
+def handle_product_failure(idx, error):
+    """Back up the input sheet and ask whether to carry on. Returns False to stop."""
+    logging.error(f"⚠️ Process halted for product {idx+1}: {error}")
+    
+    # One worker at a time, the backup and the question would interleave otherwise
+    with _console_lock:
+        # Create backup
+        os.makedirs(BACKUP_FOLDER, exist_ok=True)
+        backup_path = os.path.join(BACKUP_FOLDER, f"progress_backup_product_{idx+1}.xlsx")
+        workbook = openpyxl.load_workbook(INPUT_EXCEL_FILE)
+        workbook.save(backup_path)
+        print(f"⚠️ Backup saved to {backup_path}")
+        
+        # Ask user if they want to continue
+        response = input("\n❓ Do you want to continue with the next product? (y/n): ")
+        if response.lower() != 'y':
+            print("\n🛑 Processing stopped by user")
+            _stop_requested.set()
+            return False
+        return True
+
+def run_pipeline(driver, summary):
+    """Process claimed products with their prompts pipelined, recording outcomes in `summary`"""
+    def on_result(idx, product_data, raw_path, processed_path, share_link):
+        record_product_result(product_data, raw_path, processed_path, share_link)
+        print(f"✅ Product {idx+1} completed successfully!")
+        summary['succeeded'].append(idx + 1)
+    
+    def on_failure(idx, error):
+        summary['failed'][idx + 1] = str(error)
+        return handle_product_failure(idx, error)
+    
+    tracker = get_job_tracker(driver) if JOB_TRACKING_MODE == "network" else None
+    scheduler = PipelineScheduler(driver, claim_products(summary), tracker=tracker)
+    scheduler.run(on_result, on_failure)
+
+def run_sequential(driver, summary):
+    """Process claimed products one at a time, recording outcomes in `summary`"""
+    for idx, product_data in claim_products(summary):
+        print(f"\n🎯 {summary['worker']}: processing product {idx+1}, {summary['taken']} taken so far")
+        try:
+            # Process the product and get the results
+            updated_product_data, raw_path, processed_path, share_link = process_product(driver, product_data, idx)
+            
+            # Update Excel with results using the updated product data, completing it in the ledger
+            record_product_result(updated_product_data, raw_path, processed_path, share_link)
+            
+            print(f"✅ Product {idx+1} completed successfully!")
+            summary['succeeded'].append(idx + 1)
+            
+            # No fixed wait between products, the next product's prompts are paced by the prompts rate limiter
+            if not _products_queue.empty():
+                print(f"\n⏱️ Pacing {get_rate_limiter('prompts', driver)}")
+            
+        except Exception as e:
+            summary['failed'][idx + 1] = str(e)
+            record_product_failure(product_data, e)
+            if not handle_product_failure(idx, e):
+                break
+
+def worker_profile(worker):
+    return worker['profile']
+
+@browser(parallel=len(BROWSER_PROFILES), profile=worker_profile)
+def browser_worker(driver: Driver, worker):
+    """One browser session, logged into its own account, processing products from the shared queue"""
+    # Get browser instance
+    driver.google_get("https://midjourney.com/archive", bypass_cloudflare=True, accept_google_cookies=True)
+    
+    with _console_lock:
+        print(f"\n🔍 {worker['name']}: before we begin, please verify:")
+        print("1. You're logged into Discord")
+        print("2. You're on the MidJourney archive page")
+        print("\nPress Enter when ready, or Ctrl+C to exit...")
+        input()
+    
+    summary = {'worker': worker['name'], 'profile': worker['profile'], 'taken': 0, 'succeeded': [], 'failed': {}}
+    if PIPELINE_ENABLED:
+        run_pipeline(driver, summary)
+    else:
+        run_sequential(driver, summary)
+    summary['pacing'] = [str(limiter) for limiter in rate_limiters(driver)]
+    return summary
+
+def process_all_products():
+    """Process all products across one browser worker per entry in BROWSER_PROFILES"""
     # Initialize services
     print("\n🔄 Initializing services...")
     
@@ -23,73 +143,44 @@ def process_all_products(driver: Driver, data):
     set_google_drive_instance(drive_instance)
     print("✅ Connected to Google Drive")
     
-    # Get browser instance
-    driver.google_get("https://midjourney.com/archive", bypass_cloudflare=True, accept_google_cookies=True)
-    
-    print("\n🔍 Before we begin, please verify:")
-    print("1. You're logged into Discord")
-    print("2. You're on the MidJourney archive page")
-    print("\nPress Enter when ready, or Ctrl+C to exit...")
-    input()
-    
     data = read_prompts_from_excel(INPUT_EXCEL_FILE)  # Use the imported constant
     if not data:
         print("No valid data found in the Excel sheet.")
         return
-
-    success_count = 0
+    
+    # Products a previous run already finished are skipped, the rest resume where they stopped
+    ledger = get_product_ledger()
     total_products = len(data)
-
+    for idx, product_data in enumerate(data):
+        _, _, product_name, entry = product_ledger_entry(product_record(product_data), ledger)
+        if stage_reached(entry, 'recorded'):
+            print(f"⏭️ Skipping product {idx+1}, already completed: {product_name}")
+            total_products -= 1
+            continue
+        if entry and entry['stage']:
+            print(f"↩️ Product {idx+1} resumes after stage '{entry['stage']}': {product_name}")
+        _products_queue.put((idx, product_record(product_data)))
+    
+    workers = [
+        {'name': f"Worker {worker_idx + 1}", 'profile': profile}
+        for worker_idx, profile in enumerate(BROWSER_PROFILES)
+    ]
+    summaries = []
     try:
-        for idx, product_data in enumerate(data):
-            print(f"\n🎯 Processing product {idx+1} of {total_products}")
-            try:
-                # Process the product and get the results
-                updated_product_data = {
-                    'Product Name': product_data.get('Product Name', 'Untitled Product'),
-                    'Product Type': product_data.get('Product Type', 'Unknown Type'),
-                    'Category': product_data.get('Category', 'Uncategorized'),
-                    'Theme': product_data.get('Theme', 'No Theme'),
-                    'Prompts': product_data.get('Prompts', []),
-                    'Title': product_data.get('Title', ''),
-                    'Hook': product_data.get('Hook', ''),
-                    'Premade Description': product_data.get('Premade Description', ''),
-                    'Full Description': product_data.get('Full Description', '')
-                }
-                
-                # Process the product and get the results
-                updated_product_data, raw_path, processed_path, share_link = process_product(driver, updated_product_data, idx)
-                
-                # Update Excel with results using the updated product data
-                update_excel_with_results(updated_product_data, raw_path, processed_path, share_link)
-                
-                print(f"✅ Product {idx+1} completed successfully!")
-                success_count += 1
-                
-                # Wait between products (optional, adjust time as needed)
-                if idx < total_products - 1:  # Don't wait after the last product
-                    print(f"\n⏳ Waiting 30 seconds before next product...")
-                    time.sleep(10)
-                
-            except Exception as e:
-                logging.error(f"⚠️ Process halted for product {idx+1}: {e}")
-                
-                # Create backup
-                os.makedirs(BACKUP_FOLDER, exist_ok=True)
-                backup_path = os.path.join(BACKUP_FOLDER, f"progress_backup_product_{idx+1}.xlsx")
-                workbook = openpyxl.load_workbook(INPUT_EXCEL_FILE)
-                workbook.save(backup_path)
-                print(f"⚠️ Backup saved to {backup_path}")
-                
-                # Ask user if they want to continue
-                response = input("\n❓ Do you want to continue with the next product? (y/n): ")
-                if response.lower() != 'y':
-                    print("\n🛑 Processing stopped by user")
-                    break
-
+        print(f"\n🎯 Processing {total_products} products with {len(workers)} browser worker(s)"
+              f"{', pipelined' if PIPELINE_ENABLED else ''}")
+        summaries = [summary for summary in browser_worker(workers) if summary]
     finally:
         # Final summary
-        print(f"\n📊 Processing complete!")
+        success_count = sum(len(summary['succeeded']) for summary in summaries)
+        print("\n📊 Processing complete!")
+        for summary in summaries:
+            print(f"   {summary['worker']}: took {summary['taken']}, {len(summary['succeeded'])} succeeded, "
+                  f"{len(summary['failed'])} failed")
+            for product_number, error in summary['failed'].items():
+                print(f"      ⚠️ Product {product_number}: {error}")
+            for pacing in summary.get('pacing', []):
+                print(f"      ⏱️ {pacing}")
         print(f"✅ Successfully processed: {success_count}/{total_products} products")
         if success_count < total_products:
             print(f"⚠️ Failed: {total_products - success_count} products")
@@ -99,4 +190,4 @@ def process_all_products(driver: Driver, data):
         
 
 if __name__ == "__main__":
-    process_all_products() 
\ No newline at end of file
+    process_all_products()
\ No newline at end of file
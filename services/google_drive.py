@@ -1,12 +1,42 @@
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
+from apiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 import os
+import json
 import logging
-from config.settings import PROJECT_ROOT, SEAMLESS_PATTERN_FOLDER, DIGITAL_PAPER_FOLDER
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config.settings import (
+    PROJECT_ROOT,
+    SEAMLESS_PATTERN_FOLDER,
+    DIGITAL_PAPER_FOLDER,
+    DRIVE_UPLOAD_WORKERS,
+    DRIVE_UPLOAD_RETRIES,
+    DRIVE_INHERIT_SHARING,
+    DRIVE_API_ROOT,
+    DRIVE_BATCH_SIZE
+)
+from utils.manifest import manifest_filenames
 import time
 
 # Global drive instance
 _drive_instance = None
+# Browser workers find or create folders one product at a time, so two products never create the same folder
+_drive_lock = threading.Lock()
+# pydrive's httplib2 clients aren't thread-safe, each upload thread authorizes its own
+_thread_clients = threading.local()
+# (folder title, parent id) -> folder id, the category folders are only looked up once per run
+_folder_ids = {}
+# Services built on DRIVE_API_ROOT, pydrive rebuilds its own when it authorizes again
+_api_services = []
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+PUBLIC_PERMISSION = {
+    'type': 'anyone',
+    'role': 'reader',
+    'withLink': True
+}
 
 def init_google_drive():
     """Initialize Google Drive connection"""
@@ -29,38 +59,213 @@ def get_drive_instance():
     """Get the global drive instance"""
     return _drive_instance
 
+def _thread_http(drive):
+    """This thread's own authorized HTTP client for `drive`"""
+    if getattr(_thread_clients, 'drive', None) is not drive or _thread_clients.http is None:
+        _thread_clients.drive = drive
+        _thread_clients.http = drive.auth.Get_Http_Object()
+    return _thread_clients.http
+
+def _discovery_document():
+    """Drive v2's discovery document with its rootUrl pointed at DRIVE_API_ROOT"""
+    document = json.loads(get_static_doc('drive', 'v2'))
+    document['rootUrl'] = DRIVE_API_ROOT
+    document['baseUrl'] = DRIVE_API_ROOT + document['servicePath']
+    return document
+
+def _service(drive):
+    """The Drive v2 API service behind a pydrive instance, built on DRIVE_API_ROOT.
+
+    It takes the place of the service pydrive built, so pydrive's own
+    calls, file uploads included, go to DRIVE_API_ROOT as well.
+    """
+    if drive.auth.service is None:
+        drive.auth.Authorize()
+    if not any(service is drive.auth.service for service in _api_services):
+        drive.auth.service = build_from_document(_discovery_document(), http=drive.auth.http)
+        _api_services.append(drive.auth.service)
+    return drive.auth.service
+
+def _quote(value):
+    """A string literal for a Drive search query"""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def drive_batch(drive, requests):
+    """Run Drive API requests through the batch endpoint, DRIVE_BATCH_SIZE to an HTTP call.
+
+    `requests` are built from the service but not executed. Returns one
+    (response, error) pair per request, in the order given.
+    """
+    service = _service(drive)
+    results = [None] * len(requests)
+
+    def collect(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    for start in range(0, len(requests), DRIVE_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        for idx in range(start, min(start + DRIVE_BATCH_SIZE, len(requests))):
+            batch.add(requests[idx], request_id=str(idx))
+        batch.execute(http=_thread_http(drive))
+    return results
+
+def _create_folder(drive, title, parent_id=None):
+    folder_metadata = {
+        'title': title,
+        'mimeType': FOLDER_MIME_TYPE
+    }
+    if parent_id:
+        folder_metadata['parents'] = [{'id': parent_id}]
+    return _service(drive).files().insert(body=folder_metadata, fields='id').execute(http=_thread_http(drive))
+
+def find_or_create_product_folder(drive, category_title, product_title):
+    """The product's Drive folder inside its category folder, creating either when missing.
+
+    Both lookups go out in one batch call, and the category folder's id is
+    remembered for the rest of the run. Returns the folder's id and whether
+    anyone with the link can already open it.
+    """
+    files = _service(drive).files()
+    folder_filter = f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+    category_id = _folder_ids.get((category_title, None))
+    lookups = []
+    if category_id is None:
+        lookups.append(files.list(q=f"title={_quote(category_title)} and {folder_filter}",
+                                  maxResults=1, fields='items(id)'))
+    product_query = f"title={_quote(product_title)} and {folder_filter}"
+    if category_id is not None:
+        product_query += f" and {_quote(category_id)} in parents"
+    lookups.append(files.list(q=product_query, fields='items(id,parents(id),permissions(type,withLink))'))
+
+    results = drive_batch(drive, lookups)
+    for _, error in results:
+        if error is not None:
+            raise error
+
+    if category_id is None:
+        # Create main category folder (if it doesn't exist) - No public permissions
+        existing = results[0][0].get('items', [])
+        category_id = existing[0]['id'] if existing else _create_folder(drive, category_title)['id']
+        _folder_ids[(category_title, None)] = category_id
+
+    for folder in results[-1][0].get('items', []):
+        if any(parent['id'] == category_id for parent in folder.get('parents', [])):
+            # 'shared' is also set when the folder is only shared with someone, so look for the public permission
+            public = any(permission.get('type') == 'anyone' for permission in folder.get('permissions', []))
+            return folder['id'], public
+    folder = _create_folder(drive, product_title, parent_id=category_id)
+    return folder['id'], False
+
+def _find_file(drive, title, folder_id):
+    """The id of a file called `title` in a Drive folder, or None"""
+    query = f"title={_quote(title)} and {_quote(folder_id)} in parents and trashed=false"
+    found = _service(drive).files().list(q=query, maxResults=1, fields='items(id)').execute(http=_thread_http(drive))
+    items = found.get('items', [])
+    return items[0]['id'] if items else None
+
+def upload_file(drive, filepath, folder_id, max_retries=DRIVE_UPLOAD_RETRIES):
+    """Upload one file into a Drive folder, retrying with backoff. Returns its file id.
+
+    A failed attempt may still have created the file, so before retrying the
+    folder is searched for it by title and a file found there is kept
+    instead of uploading a duplicate. Safe to call from several threads at
+    once. The file isn't shared on its own, see upload_to_google_drive.
+    """
+    _service(drive)
+    title = os.path.basename(filepath)
+    for attempt in range(max_retries):
+        try:
+            if attempt > 0:
+                file_id = _find_file(drive, title, folder_id)
+                if file_id:
+                    return file_id
+            file_drive = drive.CreateFile({
+                'title': title,
+                'parents': [{'id': folder_id}]
+            })
+            file_drive.SetContentFile(filepath)
+            try:
+                file_drive.Upload(param={'http': _thread_http(drive)})
+            finally:
+                file_drive.content.close()
+            return file_drive['id']
+        except Exception:
+            # The connection may be broken, start the next attempt on a fresh client
+            _thread_clients.http = None
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(min(2 ** attempt, 10))
+
+def upload_files(drive, filepaths, folder_id, workers=None):
+    """Upload files into a Drive folder on `workers` (DRIVE_UPLOAD_WORKERS) threads.
+
+    Returns one file id per file, in the order given, None for files that failed.
+    """
+    if workers is None:
+        workers = DRIVE_UPLOAD_WORKERS
+    file_ids = [None] * len(filepaths)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(filepaths))),
+                            thread_name_prefix="drive-upload") as executor:
+        futures = {executor.submit(upload_file, drive, filepath, folder_id): idx
+                   for idx, filepath in enumerate(filepaths)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            filename = os.path.basename(filepaths[idx])
+            try:
+                file_ids[idx] = future.result()
+                print(f"✅ Uploaded file: {filename}")
+            except Exception as e:
+                print(f"⚠️ Failed to upload {filename}: {e}")
+    return file_ids
+
+def share_files(drive, file_ids):
+    """Make files readable by anyone with the link, in batch calls. Returns whether each one succeeded."""
+    permissions = _service(drive).permissions()
+    results = drive_batch(drive, [permissions.insert(fileId=file_id, body=PUBLIC_PERMISSION) for file_id in file_ids])
+    for file_id, (_, error) in zip(file_ids, results):
+        if error is not None:
+            print(f"⚠️ Could not share {file_id}: {error}")
+    return [error is None for _, error in results]
+
 def upload_to_google_drive(target_folder, expected_count=None, max_retries=3):
-    """Upload the processed images folder to Google Drive maintaining folder structure"""
+    """Upload the processed images folder to Google Drive maintaining folder structure.
+
+    The product folder is shared with anyone who has the link and, with
+    DRIVE_INHERIT_SHARING, its files are reached through that share instead
+    of each getting a permission of its own. Files are uploaded
+    concurrently, see upload_files, and all other Drive calls go through the
+    batch endpoint. Returns {'folder_link', 'file_links'} with the file
+    links in upload order, or None when nothing could be uploaded.
+    """
     for attempt in range(max_retries):
         try:
             print("Uploading to Google Drive...")
             drive = get_drive_instance()
             if not drive:
                 raise Exception("Google Drive not initialized")
+            # Refresh an expiring token up front, pydrive would otherwise start a browser login in each thread
+            if drive.auth.access_token_expired:
+                drive.auth.Refresh()
 
             # Determine if it's Seamless Pattern or Digital Paper from the path
             folder_type = "Seamless Pattern" if SEAMLESS_PATTERN_FOLDER in target_folder else "Digital Paper"
             
-            # Create main category folder (if it doesn't exist) - No public permissions
-            main_folder = create_or_get_folder(drive, f"Digital Paper Store - {folder_type}")
+            with _drive_lock:
+                # Create product subfolder and make it public
+                product_folder_id, public = find_or_create_product_folder(
+                    drive, f"Digital Paper Store - {folder_type}", os.path.basename(target_folder)
+                )
+                if not public and not share_files(drive, [product_folder_id])[0]:
+                    raise Exception("Could not share the product folder")
             
-            # Get the product folder name from the target path
-            product_folder_name = os.path.basename(target_folder)
-            
-            # Create product subfolder and make it public
-            product_folder = create_or_get_folder(drive, product_folder_name, parent_id=main_folder['id'])
-            # Set public permissions for product folder
-            product_folder.InsertPermission({
-                'type': 'anyone',
-                'role': 'reader',
-                'withLink': True
-            })
-            
-            # Get list of local files to upload, sorted by creation time (newest first)
-            local_files = [f for f in os.listdir(target_folder) 
-                         if os.path.isfile(os.path.join(target_folder, f)) and 
-                         f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            local_files.sort(key=lambda x: os.path.getctime(os.path.join(target_folder, x)), reverse=True)
+            # Use the processing manifest when there is one, it lists exactly this run's outputs
+            local_files = manifest_filenames(target_folder)
+            if local_files is None:
+                # Get list of local files to upload, sorted by creation time (newest first)
+                local_files = [f for f in os.listdir(target_folder) 
+                             if os.path.isfile(os.path.join(target_folder, f)) and 
+                             f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+                local_files.sort(key=lambda x: os.path.getctime(os.path.join(target_folder, x)), reverse=True)
             
             # Take only the expected number of most recent images
             if expected_count:
@@ -68,31 +273,14 @@ def upload_to_google_drive(target_folder, expected_count=None, max_retries=3):
                     print(f"⚠️ Warning: Found fewer images ({len(local_files)}) than expected ({expected_count})")
                 local_files = local_files[:expected_count]
             
-            uploaded_count = 0
-            uploaded_files_links = []
-            
             # Upload files
-            for filename in local_files:
-                filepath = os.path.join(target_folder, filename)
-                try:
-                    file_drive = drive.CreateFile({
-                        'title': filename,
-                        'parents': [{'id': product_folder['id']}]
-                    })
-                    file_drive.SetContentFile(filepath)
-                    file_drive.Upload()
-                    # Make each file public
-                    file_drive.InsertPermission({
-                        'type': 'anyone',
-                        'role': 'reader',
-                        'withLink': True
-                    })
-                    file_link = f"https://drive.google.com/uc?id={file_drive['id']}"
-                    uploaded_files_links.append(file_link)
-                    uploaded_count += 1
-                    print(f"✅ Uploaded file: {filename}")
-                except Exception as e:
-                    print(f"⚠️ Failed to upload {filename}: {e}")
+            file_ids = [file_id for file_id in upload_files(
+                drive, [os.path.join(target_folder, f) for f in local_files], product_folder_id
+            ) if file_id]
+            if file_ids and not DRIVE_INHERIT_SHARING:
+                file_ids = [file_id for file_id, ok in zip(file_ids, share_files(drive, file_ids)) if ok]
+            uploaded_files_links = [f"https://drive.google.com/uc?id={file_id}" for file_id in file_ids]
+            uploaded_count = len(uploaded_files_links)
 
             # Verify upload count
             if uploaded_count == 0:
@@ -100,7 +288,7 @@ def upload_to_google_drive(target_folder, expected_count=None, max_retries=3):
             print(f"✅ Successfully uploaded {uploaded_count}/{len(local_files)} files")
 
             # Return both folder link and individual file links
-            folder_link = f"https://drive.google.com/drive/folders/{product_folder['id']}?usp=sharing"
+            folder_link = f"https://drive.google.com/drive/folders/{product_folder_id}?usp=sharing"
             return {
                 'folder_link': folder_link,
                 'file_links': uploaded_files_links
@@ -113,27 +301,3 @@ def upload_to_google_drive(target_folder, expected_count=None, max_retries=3):
             else:
                 logging.error(f"All upload attempts failed: {e}")
                 return None
-
-def create_or_get_folder(drive, folder_name, parent_id=None):
-    """Create a folder in Google Drive or get it if it already exists"""
-    # Search for existing folder
-    query = f"title='{folder_name}' and mimeType='application/vnd.google-apps.folder'"
-    if parent_id:
-        query += f" and '{parent_id}' in parents"
-    
-    existing_folders = drive.ListFile({'q': query}).GetList()
-    
-    if existing_folders:
-        return existing_folders[0]
-    
-    # Create new folder if it doesn't exist
-    folder_metadata = {
-        'title': folder_name,
-        'mimeType': 'application/vnd.google-apps.folder'
-    }
-    if parent_id:
-        folder_metadata['parents'] = [{'id': parent_id}]
-    
-    folder = drive.CreateFile(folder_metadata)
-    folder.Upload()
-    return folder
\ No newline at end of file
@@ -1,11 +1,13 @@
 from .process import process_product
 from .navigation import ensure_on_organize_page
 from .download import download_images
+from .scheduler import PipelineScheduler
 from ..google_drive import upload_to_google_drive
 
 __all__ = [
     'process_product',
     'ensure_on_organize_page',
     'download_images',
+    'PipelineScheduler',
     'upload_to_google_drive'
 ] 
\ No newline at end of file
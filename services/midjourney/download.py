@@ -1,152 +1,729 @@
 import time
 import logging
 import os
+import io
+import re
+import json
 import shutil
 import pathlib
-import subprocess
-from config.settings import BASE_OUTPUT_FOLDER, DOWNLOADS_FOLDER, RAW_FOLDER
+import hashlib
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, urljoin
+from config.settings import (
+    BASE_OUTPUT_FOLDER,
+    DOWNLOADS_FOLDER,
+    RAW_FOLDER,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_POOL_SIZE,
+    DOWNLOAD_MAX_RETRIES,
+    DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_PER_HOST_LIMIT,
+    HARVEST_IMAGE_URLS
+)
 import platform
 from PIL import Image
+from utils.manifest import write_manifest
+from utils.download_index import DownloadIndex
+from utils.rate_limiter import get_rate_limiter
 
-def validate_image(filepath):
-    """Validate if the downloaded file is a valid image"""
+# Full-size images are served as https://cdn.midjourney.com/<job id>/0_<image index>.<ext>
+CDN_IMAGE_PATTERN = re.compile(r'/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/\d+_(\d+)', re.IGNORECASE)
+
+def parse_image_url(url):
+    """Extract (job id, image index) from a MidJourney CDN URL, or (None, None)"""
+    match = CDN_IMAGE_PATTERN.search(urlparse(url).path)
+    if not match:
+        return None, None
+    return match.group(1).lower(), int(match.group(2))
+
+def full_size_url(job_id, image_index):
+    """CDN URL of a job's full-size image"""
+    return f"https://cdn.midjourney.com/{job_id}/0_{image_index}.png"
+
+def image_filename(url):
+    """Deterministic local filename for an image URL: <job id>_<image index>.<ext>"""
+    path = urlparse(url).path
+    file_extension = os.path.splitext(path)[1] or '.png'  # Default to .png if no extension
+    job_id, image_index = parse_image_url(url)
+    if job_id:
+        return f"{job_id}_{image_index}{file_extension}"
+    # Not a CDN URL we recognise, fall back to a hash of the URL so the name is still stable
+    return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}{file_extension}"
+
+# Set User-Agent based on platform
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    if platform.system() == "Windows"
+    else "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+DOWNLOAD_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Referer': 'https://www.midjourney.com/',
+    'Connection': 'keep-alive'
+}
+IMAGES_PER_JOB = 4
+CHUNK_SIZE = 256 * 1024
+# Partial downloads are synced to disk this often, so even a power loss keeps most of the progress
+PART_SYNC_BYTES = 4 * 1024 * 1024
+MAX_REDIRECTS = 5
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections reused across downloads, per host.
+
+    Each connection is handed to one caller at a time, so the pool can be
+    shared between threads.
+    """
+
+    def __init__(self, max_idle_per_host=DOWNLOAD_POOL_SIZE, timeout=DOWNLOAD_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, scheme, host, port):
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def acquire(self, scheme, host, port):
+        """An idle connection to the host, or a new one. Returns (connection, reused)."""
+        with self._lock:
+            idle = self._idle.get((scheme, host, port))
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(scheme, host, port), False
+
+    def replace(self, scheme, host, port, connection):
+        """Close a connection the server dropped and return a fresh one to the same host"""
+        connection.close()
+        return self._new_connection(scheme, host, port)
+
+    def release(self, scheme, host, port, connection, reusable=True):
+        """Hand a connection back, keeping it open for the next request if it can be reused"""
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault((scheme, host, port), [])
+                if len(idle) < self.max_idle_per_host:
+                    idle.append(connection)
+                    return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+
+# Global connection pool
+_connection_pool = None
+
+def get_connection_pool():
+    """Get the global connection pool, creating it on first use"""
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = ConnectionPool()
+    return _connection_pool
+
+def _split_url(url):
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    path = parsed.path or '/'
+    if parsed.query:
+        path = f"{path}?{parsed.query}"
+    return parsed.scheme, parsed.hostname, port, path
+
+# Leading bytes of the formats the CDN serves
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',
+    b'GIF87a',
+    b'GIF89a',
+)
+
+class NotAnImageError(ValueError):
+    """The server answered with something other than an image, retrying won't change that"""
+
+def looks_like_image(prefix):
+    """Whether the first bytes of a body are an image header, so error pages are dropped early"""
+    if prefix[:4] == b'RIFF' and prefix[8:12] == b'WEBP':
+        return True
+    return any(prefix.startswith(signature) for signature in IMAGE_SIGNATURES)
+
+def validate_image_bytes(data):
+    """Validate a downloaded image held in memory"""
     try:
-        with Image.open(filepath) as img:
-            # Try to load the image data
+        with Image.open(io.BytesIO(data)) as img:
             img.verify()
-            # If we can load and verify the image, it's valid
             return True
     except Exception as e:
         print(f"❌ Invalid image file: {e}")
-        # Remove the corrupted file
-        if os.path.exists(filepath):
-            os.remove(filepath)
         return False
 
-def download_with_retry(url, product_folder_path, driver=None, max_retries=5):
-    """Download file using curl with retries"""
+# Background writer for finished raw files, so the download threads go straight back to the network
+_raw_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="raw-writer")
+
+def _read_part_info(part_path):
+    """Metadata saved alongside a partial download, or None"""
+    try:
+        with open(f"{part_path}.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _open_part(part_path, info, append):
+    """Open a partial download for writing, after saving the metadata a later attempt or run resumes it with"""
+    with open(f"{part_path}.json", 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    # Unbuffered, so every chunk reaches the OS as soon as it arrives and survives the process being killed
+    return open(part_path, 'ab' if append else 'wb', buffering=0)
+
+def _discard_part(part_path):
+    for path in (part_path, f"{part_path}.json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _write_raw_file(filepath, data, part_path):
+    """Write a verified download to its final name. Runs on the background writer."""
+    temp_path = f"{filepath}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, filepath)
+    _discard_part(part_path)
+    return filepath
+
+def _content_range_total(response):
+    """Total size from a 'bytes start-end/total' or 'bytes */total' Content-Range header"""
+    content_range = response.getheader('Content-Range') or ''
+    total = content_range.rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+def _fetch(pool, url, part_path, headers):
+    """GET url into memory over a pooled connection, resuming a saved .part with a Range request.
+
+    A partial file is only resumed when its saved metadata matches the URL,
+    and If-Range makes the server send the whole file again if it changed.
+    The body is checked for an image header as soon as it starts arriving,
+    and each chunk is kept in memory and appended to the part as it arrives.
+    Returns (status, bytes transferred, body, expected total size or None, part info).
+    """
+    data = bytearray()
+    # Parts are matched on the URL asked for, redirects may lead somewhere else each time
+    requested_url = url
+    info = _read_part_info(part_path) if os.path.exists(part_path) else None
+    if info and info.get('url') == requested_url:
+        with open(part_path, 'rb') as f:
+            data.extend(f.read())
+    elif os.path.exists(part_path):
+        _discard_part(part_path)
+        info = None
+    offset = len(data)
+
+    request_headers = dict(headers)
+    if offset:
+        request_headers['Range'] = f"bytes={offset}-"
+        validator = info.get('etag') or info.get('last_modified')
+        if validator:
+            request_headers['If-Range'] = validator
+
+    for _ in range(MAX_REDIRECTS + 1):
+        scheme, host, port, path = _split_url(url)
+        connection, reused = pool.acquire(scheme, host, port)
+        try:
+            try:
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                if not reused:
+                    raise
+                # The server closed an idle keep-alive connection, retry once on a fresh one
+                connection = pool.replace(scheme, host, port, connection)
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                response.read()
+                pool.release(scheme, host, port, connection, not response.will_close)
+                url = urljoin(url, response.getheader('Location'))
+                continue
+
+            if response.status == 416 and offset:
+                # Nothing left to send: either the part is already complete or it's bogus
+                response.read()
+                pool.release(scheme, host, port, connection, not response.will_close)
+                total = _content_range_total(response)
+                if total == offset:
+                    return 206, 0, data, total, info
+                _discard_part(part_path)
+                return response.status, 0, bytearray(), None, None
+
+            if response.status not in (200, 206):
+                response.read()
+                pool.release(scheme, host, port, connection, not response.will_close)
+                return response.status, 0, data, None, info
+
+            content_length = response.getheader('Content-Length')
+            if response.status == 206:
+                range_start = (response.getheader('Content-Range') or '').partition(' ')[2].partition('-')[0]
+                if not range_start.isdigit() or int(range_start) != offset:
+                    raise Exception(f"Server resumed at {range_start or 'an unknown offset'} instead of {offset}")
+                total = _content_range_total(response)
+            else:
+                # Full response: the server ignored the range or the file changed, start over
+                data = bytearray()
+                offset = 0
+                total = int(content_length) if content_length and content_length.isdigit() else None
+                info = {
+                    'url': requested_url,
+                    'etag': response.getheader('ETag'),
+                    'last_modified': response.getheader('Last-Modified'),
+                    'total': total
+                }
+
+            transferred = 0
+            header_checked = offset > 0
+            unsynced = 0
+            part_file = _open_part(part_path, info, append=offset > 0)
+            try:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    data.extend(chunk)
+                    transferred += len(chunk)
+                    if not header_checked and len(data) >= 16:
+                        header_checked = True
+                        if not looks_like_image(bytes(data[:16])):
+                            # An error page or truncated object, don't download the rest of it
+                            part_file.close()
+                            _discard_part(part_path)
+                            raise NotAnImageError("Response is not an image")
+                    part_file.write(chunk)
+                    unsynced += len(chunk)
+                    if unsynced >= PART_SYNC_BYTES:
+                        os.fsync(part_file.fileno())
+                        unsynced = 0
+            finally:
+                part_file.close()
+            pool.release(scheme, host, port, connection, not response.will_close)
+            return response.status, transferred, data, total, info
+        except Exception:
+            connection.close()
+            raise
+    raise Exception(f"Too many redirects for URL: {url}")
+
+def download_image(url, product_folder_path, filename=None, max_retries=DOWNLOAD_MAX_RETRIES, pool=None,
+                   expected_sha256=None, keep_data=False):
+    """Download one image over pooled keep-alive connections, with retries.
+
+    A body whose hash isn't `expected_sha256`, when given, is rejected. The raw copy is written on a background thread, so wait on the result's
+    'write' future before reading the file. Returns a dict with url, filepath,
+    success, status, bytes, size, sha256, elapsed, retries, error, write and,
+    with keep_data, data.
+    """
     # Create product folder if it doesn't exist
     os.makedirs(product_folder_path, exist_ok=True)
-    os.chdir(product_folder_path)
-    
-    # Set User-Agent based on platform
-    user_agent = (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        if platform.system() == "Windows"
-        else "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    )
-    
-    # Generate timestamp filename
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    file_extension = os.path.splitext(url)[1] or '.png'  # Default to .png if no extension
-    custom_filename = f"{timestamp}{file_extension}"
-    filepath = os.path.join(product_folder_path, custom_filename)
-    
+    # Name the file after its job and image index so concurrent or repeated downloads never collide
+    filepath = os.path.join(product_folder_path, filename or image_filename(url))
+    part_path = f"{filepath}.part"
+    pool = pool or get_connection_pool()
+    limiter = get_rate_limiter("downloads")
+
+    start_time = time.perf_counter()
+    status = None
+    transferred = 0
+    error = None
     for attempt in range(max_retries):
         try:
-            command = [
-                'curl',
-                '-H', f'User-Agent: {user_agent}',
-                '-H', 'Referer: https://www.midjourney.com/',
-                '-o', custom_filename,
-                url
-            ]
-            subprocess.run(command, check=True)
-            
-            # Validate the downloaded image
-            if validate_image(filepath):
-                return True
+            limiter.acquire()
+            status, attempt_bytes, data, total, info = _fetch(pool, url, part_path, DOWNLOAD_HEADERS)
+            transferred += attempt_bytes
+            # Throttling and server errors slow every download down, not just this one
+            if status == 429 or status >= 500:
+                limiter.failure(f"HTTP {status}")
             else:
-                print(f"Downloaded file is not a valid image, attempt {attempt + 1}")
-                # Remove the invalid file
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                    print(f"Removed invalid file: {filepath}")
-                
-                # Try immediate redownload up to 3 times
-                for retry_attempt in range(3):
-                    print(f"Immediate retry attempt {retry_attempt + 1}")
-                    try:
-                        subprocess.run(command, check=True)
-                        if validate_image(filepath):
-                            print(f"✅ Successful download on retry {retry_attempt + 1}")
-                            return True
-                        else:
-                            # Clean up invalid file before next attempt
-                            if os.path.exists(filepath):
-                                os.remove(filepath)
-                    except subprocess.CalledProcessError as e:
-                        print(f"Download failed on retry {retry_attempt + 1}: {e}")
-                        if os.path.exists(filepath):
-                            os.remove(filepath)
-                continue
-                
-        except subprocess.CalledProcessError as e:
-            if attempt < max_retries - 1:
-                print(f"Download attempt {attempt + 1} failed. Retrying...")
-                time.sleep(2)
+                limiter.success()
+            if status in (200, 206):
+                if total is not None and len(data) != total:
+                    # Connection dropped mid-body, the part already holds what arrived and resumes next attempt
+                    raise Exception(f"Incomplete download: {len(data)}/{total} bytes")
+                data = bytes(data)
+                sha256 = hashlib.sha256(data).hexdigest()
+                if expected_sha256 and sha256 != expected_sha256:
+                    _discard_part(part_path)
+                    error = "Downloaded file does not match the expected hash"
+                    # Only a resumed part can be at fault, a whole file from the server won't change on retry
+                    if attempt_bytes == len(data):
+                        break
+                # Validate the downloaded image
+                elif validate_image_bytes(data):
+                    return {
+                        'url': url,
+                        'filepath': filepath,
+                        'success': True,
+                        'status': status,
+                        'bytes': transferred,
+                        'size': len(data),
+                        'sha256': sha256,
+                        'elapsed': time.perf_counter() - start_time,
+                        'retries': attempt,
+                        'error': None,
+                        'write': _raw_writer.submit(_write_raw_file, filepath, data, part_path),
+                        'data': data if keep_data else None
+                    }
+                else:
+                    _discard_part(part_path)
+                    error = "Downloaded file is not a valid image"
             else:
-                print(f"❌ All download attempts failed for URL: {url}")
-                return False
-    
-    return False
+                error = f"HTTP {status}"
+                # Client errors other than rate limiting won't fix themselves
+                if 400 <= status < 500 and status not in (416, 429):
+                    break
+        except (http.client.HTTPException, OSError) as e:
+            limiter.failure(str(e))
+            error = str(e)
+        except NotAnImageError as e:
+            # Like a client error, the same URL will serve the same page again
+            error = str(e)
+            break
+        except Exception as e:
+            error = str(e)
+
+        if attempt < max_retries - 1:
+            print(f"Download attempt {attempt + 1} failed ({error}). Retrying...")
+            time.sleep(min(2 ** attempt, 10))
 
-def download_images(driver, product_name, expected_count=None):
-    """Downloads selected images from MidJourney."""
+    print(f"❌ All download attempts failed for URL: {url}")
+    return {
+        'url': url,
+        'filepath': filepath,
+        'success': False,
+        'status': status,
+        'bytes': transferred,
+        'size': None,
+        'sha256': None,
+        'elapsed': time.perf_counter() - start_time,
+        'retries': attempt,
+        'error': error,
+        'write': None,
+        'data': None
+    }
+
+def download_with_retry(url, product_folder_path, driver=None, max_retries=DOWNLOAD_MAX_RETRIES, filename=None):
+    """Download file with retries, returning whether it succeeded once the file is on disk"""
+    result = download_image(url, product_folder_path, filename=filename, max_retries=max_retries)
+    if result['success']:
+        result['write'].result()
+    return result['success']
+
+def download_many(urls, product_folder_path, concurrency=None, per_host_limit=None, keep_data=False,
+                  expected_sha256s=None):
+    """Download many images concurrently on a thread pool.
+
+    At most `concurrency` downloads run at once and at most `per_host_limit`
+    against any one host. Progress and failures are reported per file as
+    they finish. Returns one result dict per URL, in the order given, once
+    every raw file has been written. With keep_data each result also holds
+    the verified bytes, for handing straight to processing.
+    `expected_sha256s` maps URLs to the hash their download must have.
+    """
+    if concurrency is None:
+        concurrency = DOWNLOAD_CONCURRENCY
+    if per_host_limit is None:
+        per_host_limit = DOWNLOAD_PER_HOST_LIMIT
+
+    host_limits = {}
+    host_limits_lock = threading.Lock()
+
+    def host_limit(url):
+        host = urlparse(url).hostname
+        with host_limits_lock:
+            if host not in host_limits:
+                host_limits[host] = threading.BoundedSemaphore(per_host_limit)
+            return host_limits[host]
+
+    def download(url):
+        with host_limit(url):
+            return download_image(url, product_folder_path, keep_data=keep_data,
+                                  expected_sha256=(expected_sha256s or {}).get(url))
+
+    results = [None] * len(urls)
+    finished_count = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as executor:
+        futures = {executor.submit(download, url): idx for idx, url in enumerate(urls)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            finished_count += 1
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {
+                    'url': urls[idx],
+                    'filepath': None,
+                    'success': False,
+                    'status': None,
+                    'bytes': 0,
+                    'size': None,
+                    'sha256': None,
+                    'elapsed': 0,
+                    'retries': 0,
+                    'error': str(e),
+                    'write': None,
+                    'data': None
+                }
+            results[idx] = result
+            if result['success']:
+                print(f"✅ [{finished_count}/{len(urls)}] {os.path.basename(result['filepath'])} "
+                      f"({result['size'] / (1024 * 1024):.1f} MB in {result['elapsed']:.1f}s)")
+            else:
+                print(f"⚠️ [{finished_count}/{len(urls)}] Failed to download image {idx + 1}: {result['error']}")
+
+    for result in results:
+        if result['success']:
+            try:
+                result['write'].result()
+            except Exception as e:
+                result['success'] = False
+                result['error'] = f"Could not write raw file: {e}"
+                print(f"⚠️ Could not write {result['filepath']}: {e}")
+    return results
+
+# Reads every archive grid image in one round trip. Job id and image index come from the
+# /jobs/<id>?index=<n> link around the thumbnail, or from the thumbnail's CDN URL.
+HARVEST_IMAGES_JS = r"""
+const jobPattern = /([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/i;
+const cdnPattern = /cdn\.midjourney\.com\/([0-9a-f-]{36})\/\d+_(\d+)/i;
+const seen = new Set();
+const entries = [];
+Array.from(document.querySelectorAll('img')).forEach((img, position) => {
+    const link = img.closest('a[href*="/jobs/"]');
+    const href = link ? link.getAttribute('href') : '';
+    const src = img.currentSrc || img.src || '';
+    const cdnMatch = src.match(cdnPattern);
+    if (!link && !cdnMatch) {
+        return;  // Avatars, icons and other page chrome
+    }
+    let jobId = null;
+    let index = null;
+    const jobMatch = href.match(jobPattern);
+    if (jobMatch) {
+        jobId = jobMatch[1].toLowerCase();
+        const indexMatch = href.match(/[?&]index=(\d+)/);
+        index = indexMatch ? parseInt(indexMatch[1], 10) : null;
+    }
+    if (cdnMatch) {
+        jobId = jobId || cdnMatch[1].toLowerCase();
+        index = index === null ? parseInt(cdnMatch[2], 10) : index;
+    }
+    const key = jobId && index !== null ? jobId + '_' + index : 'position_' + position;
+    if (seen.has(key)) {
+        return;
+    }
+    seen.add(key);
+    entries.push({position: position, job_id: jobId, index: index, prompt: img.alt || ''});
+});
+return entries;
+"""
+
+def harvest_archive_images(driver):
+    """Every image on the archive grid, newest first, from a single driver.run_js call.
+
+    Each entry has position (index among the page's img elements), job_id,
+    index and prompt. job_id or index is None when it couldn't be resolved.
+    """
+    return driver.run_js(HARVEST_IMAGES_JS) or []
+
+def reuse_indexed_download(entry, filepath, keep_data=False):
+    """Place an already downloaded image at filepath instead of fetching it again.
+
+    Returns a download_many style result, or None if the indexed copy can't
+    be used and the image has to be downloaded.
+    """
+    try:
+        if os.path.abspath(entry['local_path']) != os.path.abspath(filepath):
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            try:
+                os.link(entry['local_path'], filepath)
+            except OSError:
+                shutil.copy2(entry['local_path'], filepath)
+        data = None
+        if keep_data:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            # The bytes go straight to processing, so make sure they're still what was downloaded
+            if hashlib.sha256(data).hexdigest() != entry['sha256']:
+                return None
+    except OSError as e:
+        logging.error(f"Error reusing {entry['local_path']}: {e}")
+        return None
+    return {
+        'url': entry['url'],
+        'filepath': filepath,
+        'success': True,
+        'status': None,
+        'bytes': 0,
+        'size': entry['size'],
+        'sha256': entry['sha256'],
+        'elapsed': 0,
+        'retries': 0,
+        'error': None,
+        'write': None,
+        'data': data
+    }
+
+def read_image_url_by_click(driver, image_element):
+    """Open an image's detail view to read its full-size URL, then close it"""
+    limiter = get_rate_limiter("navigation", driver)
+    limiter.acquire()
+    try:
+        image_element.click()
+        
+        img_element = driver.wait_for_element('img[style="filter: none;"]')
+        img_url = img_element.get_attribute("src")
+        
+        exit_button = driver.wait_for_element('button[title="Close"]')
+        exit_button.click()
+    except Exception as e:
+        limiter.failure(str(e))
+        raise
+    limiter.success()
+    return img_url
+
+def download_images(driver, product_name, expected_count=None, harvest=None, buffers=None, index=None, job_ids=None):
+    """Downloads selected images from MidJourney.
+
+    With `harvest` (defaults to HARVEST_IMAGE_URLS) all full-size URLs are
+    read from the archive grid in one script call, and only the images it
+    can't resolve are opened one by one. When a `buffers` dict is passed it
+    is filled with filename -> verified image bytes, so processing doesn't
+    have to read the raw files back from disk.
+
+    Images already in the download index are linked from their earlier
+    download instead of being fetched again, and every new download is
+    recorded in it. When the product's `job_ids` are known, newest first,
+    their images are downloaded directly without reading the page.
+    """
     print("Selecting and downloading images...")
+    owned_index = None
     try:
         # Create product-specific folder within RAW_FOLDER
         product_raw_folder = os.path.join(RAW_FOLDER, product_name)
         os.makedirs(product_raw_folder, exist_ok=True)
         
-        # Get all available images
-        images = driver.select_all("img")
+        if harvest is None:
+            harvest = HARVEST_IMAGE_URLS
+        
+        entries = []
+        images = []
+        if job_ids:
+            entries = [{'position': None, 'job_id': job_id, 'index': image_index}
+                       for job_id in job_ids for image_index in range(IMAGES_PER_JOB)]
+            harvest = False
+        else:
+            # Get all available images
+            images = driver.select_all("img")
+        
+        if harvest:
+            try:
+                entries = harvest_archive_images(driver)
+            except Exception as e:
+                print(f"⚠️ Could not harvest image URLs, opening images one by one: {e}")
+        if not entries and not job_ids:
+            # No harvest: treat every image on the page as a grid image, as before
+            entries = [{'position': idx, 'job_id': None, 'index': None} for idx in range(len(images))]
         
         # Take only the expected number of most recent images
         if expected_count:
-            images = images[:expected_count]  # Most recent images appear first
-            total_images = expected_count
-        else:
-            total_images = len(images)
+            entries = entries[:expected_count]  # Most recent images appear first
+        total_images = len(entries)
         
         if total_images == 0:
             raise Exception("No images found to download")
             
         print(f"Found {total_images} images to download")
         
-        downloaded_count = 0
-        max_attempts = 3
-        
-        # Download the most recent images first
-        for idx in range(total_images):
+        # Collect the full-size URLs first, the downloads then run concurrently
+        image_urls = []
+        clicked_count = 0
+        for idx, entry in enumerate(entries):
+            if entry['job_id'] and entry['index'] is not None:
+                image_urls.append(full_size_url(entry['job_id'], entry['index']))
+                continue
             try:
-                current_image = images[idx]
-                current_image.click()
-                time.sleep(2)
-                
-                img_element = driver.wait_for_element('img[style="filter: none;"]')
-                img_url = img_element.get_attribute("src")
-                
-                if download_with_retry(img_url, product_raw_folder, driver):
-                    downloaded_count += 1
-                    print(f"✅ Downloaded image {downloaded_count}/{total_images}")
-                else:
-                    print(f"⚠️ Failed to download image {idx + 1}")
-                
-                exit_button = driver.wait_for_element('button[title="Close"]')
-                exit_button.click()
-                
+                image_urls.append(read_image_url_by_click(driver, images[entry['position']]))
+                clicked_count += 1
             except Exception as e:
-                print(f"⚠️ Error downloading image {idx + 1}: {e}")
-                time.sleep(2)
+                print(f"⚠️ Error reading image {idx + 1}: {e}")
+        if harvest:
+            print(f"Resolved {total_images - clicked_count}/{total_images} image URLs from the archive grid")
+        
+        if index is None:
+            index = owned_index = DownloadIndex()
+        
+        # Skip images an earlier run already downloaded
+        results = [None] * len(image_urls)
+        pending = []
+        expected_sha256s = {}
+        for idx, url in enumerate(image_urls):
+            job_id, image_index = parse_image_url(url)
+            entry = index.find_local_copy(job_id, image_index) if job_id else None
+            if entry:
+                if entry['product'] != product_name:
+                    print(f"⚠️ {job_id} image {image_index} was already downloaded for {entry['product']}")
+                filepath = os.path.join(product_raw_folder, image_filename(url))
+                results[idx] = reuse_indexed_download(entry, filepath, keep_data=buffers is not None)
+            if results[idx] is None:
+                pending.append(idx)
+                # A job's images never change, so one downloaded before has to come back with the same hash
+                indexed = index.get(job_id, image_index) if job_id else None
+                if indexed and indexed['sha256']:
+                    expected_sha256s[url] = indexed['sha256']
+        if len(pending) < len(image_urls):
+            print(f"Reusing {len(image_urls) - len(pending)} images downloaded in an earlier run")
+        
+        # Download the most recent images first
+        downloaded = download_many([image_urls[idx] for idx in pending], product_raw_folder,
+                                   keep_data=buffers is not None, expected_sha256s=expected_sha256s) if pending else []
+        for idx, result in zip(pending, downloaded):
+            results[idx] = result
+            job_id, image_index = parse_image_url(result['url'])
+            if result['success'] and job_id:
+                index.record(job_id, image_index, result['url'], result['filepath'],
+                             result['size'], result['sha256'], product_name)
+        
+        manifest_entries = []
+        for result in results:
+            if not result['success']:
+                continue
+            job_id, image_index = parse_image_url(result['url'])
+            if buffers is not None:
+                buffers[os.path.basename(result['filepath'])] = result['data']
+            manifest_entries.append({
+                'job_id': job_id,
+                'image_index': image_index,
+                'filename': os.path.basename(result['filepath']),
+                'url': result['url'],
+                'size': result['size'],
+                'sha256': result['sha256'],
+                'downloaded_at': time.strftime("%Y-%m-%d %H:%M:%S")
+            })
+        downloaded_count = len(manifest_entries)
         
         if downloaded_count == 0:
             raise Exception("No images were downloaded successfully")
+
+        # Downstream stages read this instead of guessing the newest files from ctimes
+        write_manifest(product_raw_folder, manifest_entries, product=product_name)
             
-        print(f"✅ Successfully downloaded {downloaded_count} images")
+        print(f"✅ Successfully downloaded {downloaded_count}/{total_images} images")
         return product_raw_folder
 
     except Exception as e:
         logging.error(f"Error in download_images: {e}")
-        raise 
-    
\ No newline at end of file
+        raise
+    finally:
+        if owned_index is not None:
+            owned_index.close() 
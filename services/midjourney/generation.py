@@ -0,0 +1,152 @@
+import time
+import logging
+from .job_tracker import prompt_matches
+from config.settings import (
+    WAIT_BETWEEN_IMAGE_CHECKS,
+    MAX_IMAGE_WAIT_TIME,
+    GENERATION_FIRST_CHECK_DELAY,
+    GENERATION_MIN_CHECK_INTERVAL,
+    GENERATION_BACKOFF
+)
+
+# Reads the generation state of the archive grid in one round trip. A job is pending while any
+# of its tiles shows a progress percentage or status text, or has no finished CDN image yet.
+GENERATION_STATUS_JS = r"""
+const jobPattern = /([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/i;
+const finishedPattern = /cdn\.midjourney\.com\/[0-9a-f-]{36}\/\d+_\d+/i;
+// A whole status label such as "Queued", "Generating... 45%" or "45%". Cards show the prompt
+// too, and a prompt can contain words like "generating", so prompt text never counts.
+const statusPattern = /^(\d{1,3}\s?%|(waiting|queued|submitting|starting|generating)(\s+to\s+start)?[\s.…:]*(\d{1,3}\s?%)?)$/i;
+function showsProgress(link, prompt) {
+    if (link.querySelector('[role="progressbar"], [aria-busy="true"]')) {
+        return true;
+    }
+    const promptText = (prompt || '').toLowerCase();
+    const walker = document.createTreeWalker(link, NodeFilter.SHOW_TEXT);
+    while (walker.nextNode()) {
+        const text = walker.currentNode.data.trim();
+        if (text && !promptText.includes(text.toLowerCase()) && statusPattern.test(text)) {
+            return true;
+        }
+    }
+    return false;
+}
+const complete = new Set();
+const pending = new Set();
+const prompts = {};
+const order = [];
+let anonymousPending = 0;
+document.querySelectorAll('a[href*="/jobs/"]').forEach(link => {
+    const match = (link.getAttribute('href') || '').match(jobPattern);
+    if (!match) {
+        return;
+    }
+    const jobId = match[1].toLowerCase();
+    if (!order.includes(jobId)) {
+        order.push(jobId);
+    }
+    const img = link.querySelector('img');
+    const src = img ? (img.currentSrc || img.src || '') : '';
+    if (img && img.alt) {
+        prompts[jobId] = img.alt;
+    }
+    if (showsProgress(link, img && img.alt) || !finishedPattern.test(src) || /progress/i.test(src)) {
+        pending.add(jobId);
+    } else {
+        complete.add(jobId);
+    }
+});
+// Jobs still queued often render as placeholders without a /jobs/ link yet
+document.querySelectorAll('[role="progressbar"], [aria-busy="true"]').forEach(el => {
+    if (!el.closest('a[href*="/jobs/"]')) {
+        anonymousPending += 1;
+    }
+});
+pending.forEach(jobId => complete.delete(jobId));
+return {complete: Array.from(complete), pending: Array.from(pending), prompts: prompts, order: order, anonymous_pending: anonymousPending};
+"""
+
+def read_generation_state(driver):
+    """Finished and pending job ids on the archive page, from a single driver.run_js call.
+
+    Returns a dict with complete and pending (sets of job ids), order (all
+    job ids as laid out, newest first), prompts (job id -> prompt, from the
+    image alt text) and anonymous_pending, the number of placeholders not
+    yet tied to a job.
+    """
+    state = driver.run_js(GENERATION_STATUS_JS) or {}
+    return {
+        'complete': set(state.get('complete', [])),
+        'pending': set(state.get('pending', [])),
+        'prompts': state.get('prompts', {}),
+        'order': state.get('order', []),
+        'anonymous_pending': state.get('anonymous_pending', 0)
+    }
+
+def completed_job_ids(driver):
+    """Job ids already finished on the archive page, taken before submitting so they aren't counted"""
+    try:
+        return read_generation_state(driver)['complete']
+    except Exception as e:
+        logging.error(f"Error reading generation state: {e}")
+        return set()
+
+def wait_for_generation(driver, expected_jobs, baseline_job_ids=None, timeout=None, max_interval=None, prompts=None):
+    """Poll the archive page until `expected_jobs` new jobs have finished.
+
+    Jobs finished before submission (`baseline_job_ids`) don't count, nor,
+    when `prompts` is given, jobs whose prompt is known and isn't one of
+    them. The first check waits GENERATION_FIRST_CHECK_DELAY, then the
+    interval starts at GENERATION_MIN_CHECK_INTERVAL and grows by
+    GENERATION_BACKOFF up to `max_interval` (WAIT_BETWEEN_IMAGE_CHECKS)
+    while nothing changes. It drops back to the minimum as soon as a job
+    finishes. Raises TimeoutError after `timeout` (MAX_IMAGE_WAIT_TIME)
+    seconds. Returns the new job ids, newest first.
+    """
+    if timeout is None:
+        timeout = MAX_IMAGE_WAIT_TIME
+    if max_interval is None:
+        max_interval = WAIT_BETWEEN_IMAGE_CHECKS
+    baseline_job_ids = set(baseline_job_ids or ())
+
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+    interval = GENERATION_MIN_CHECK_INTERVAL
+    time.sleep(min(GENERATION_FIRST_CHECK_DELAY, timeout))
+    last_progress = None
+    new_jobs = set()
+    pending_count = 0
+    state = {'complete': set(), 'pending': set(), 'anonymous_pending': 0}
+    while True:
+        try:
+            state = read_generation_state(driver)
+            new_jobs = state['complete'] - baseline_job_ids
+            if prompts:
+                new_jobs = {job_id for job_id in new_jobs
+                            if job_id not in state['prompts'] or prompt_matches(state['prompts'][job_id], prompts)}
+            pending_count = len(state['pending'] - baseline_job_ids) + state['anonymous_pending']
+        except Exception as e:
+            # A page reload or verification screen in the way, try again on the next check
+            logging.error(f"Error reading generation state: {e}")
+
+        elapsed = time.monotonic() - start_time
+        # Placeholders not yet tied to a job are only reported, page chrome can look the same
+        if len(new_jobs) >= expected_jobs and not state['pending'] - baseline_job_ids:
+            print(f"✅ {len(new_jobs)}/{expected_jobs} jobs finished after {elapsed:.0f}s")
+            return [job_id for job_id in state['order'] if job_id in new_jobs]
+
+        progress = (len(new_jobs), pending_count)
+        if progress != last_progress:
+            interval = GENERATION_MIN_CHECK_INTERVAL
+            print(f"⏳ {len(new_jobs)}/{expected_jobs} jobs finished, {pending_count} in progress ({elapsed:.0f}s)")
+        else:
+            interval = min(interval * GENERATION_BACKOFF, max_interval)
+        last_progress = progress
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"Only {len(new_jobs)}/{expected_jobs} jobs finished within {timeout}s "
+                f"({pending_count} still in progress)"
+            )
+        time.sleep(min(interval, remaining))
@@ -0,0 +1,212 @@
+import re
+import json
+import time
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from botasaurus.browser import cdp
+from config.settings import JOB_STATUS_URL_PATTERN, JOB_TRACKING_SILENCE_TIMEOUT, MAX_IMAGE_WAIT_TIME
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+COMPLETE_STATUSES = {'completed', 'complete', 'done', 'finished', 'success'}
+FAILED_STATUSES = {'failed', 'error', 'cancelled', 'canceled', 'moderated', 'banned'}
+# Socket.IO style frames put a numeric packet type before the JSON, e.g. 42["job_update", {...}]
+FRAME_PREFIX_PATTERN = re.compile(r'^\d+')
+
+def _normalize_prompt(prompt):
+    return ' '.join(prompt.lower().split())
+
+def prompt_matches(job_prompt, prompts):
+    """Whether a job's prompt is one of `prompts`. MidJourney may append parameters to what was typed."""
+    job_prompt = _normalize_prompt(job_prompt)
+    return any(job_prompt.startswith(_normalize_prompt(prompt)) for prompt in prompts)
+
+def _job_fields(obj):
+    """(job id, status, progress, prompt) if a decoded JSON object describes a job, else None"""
+    job_id = obj.get('job_id') or obj.get('jobId') or obj.get('id')
+    if not isinstance(job_id, str) or not JOB_ID_PATTERN.match(job_id):
+        return None
+    status = obj.get('status') or obj.get('state') or obj.get('current_status') or obj.get('event_type')
+    progress = obj.get('progress', obj.get('percentage_complete'))
+    if status is None and progress is None:
+        return None
+    prompt = obj.get('prompt') or obj.get('full_command') or obj.get('text')
+    return job_id.lower(), str(status or '').lower(), progress, prompt if isinstance(prompt, str) else None
+
+class JobTracker:
+    """In-memory table of MidJourney jobs built from the web app's own network traffic.
+
+    Frames and response bodies are fed in as decoded JSON (feed_event) or raw
+    text (feed_text), so the tracker works the same whether the events come
+    from the browser via attach() or from a stand-in page or recording.
+    Waiters are woken as soon as a job's state changes.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self._seq = 0
+        self._version = 0
+        self._condition = threading.Condition()
+        self._watched_requests = {}
+        self._body_reader = None
+
+    def mark(self):
+        """A point in the event stream. Jobs first seen after it belong to the next submission."""
+        with self._condition:
+            return self._seq
+
+    def feed_event(self, payload):
+        """Record every job state found anywhere in a decoded JSON payload. Returns how many were found."""
+        found = 0
+        stack = [payload]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, list):
+                stack.extend(obj)
+                continue
+            if not isinstance(obj, dict):
+                continue
+            fields = _job_fields(obj)
+            if fields:
+                self._update(*fields)
+                found += 1
+            stack.extend(value for value in obj.values() if isinstance(value, (dict, list)))
+        return found
+
+    def feed_text(self, text):
+        """Feed a WebSocket frame or response body. Anything that isn't JSON is ignored."""
+        text = FRAME_PREFIX_PATTERN.sub('', text.strip(), count=1)
+        if not text or text[0] not in '[{':
+            return 0
+        try:
+            return self.feed_event(json.loads(text))
+        except ValueError:
+            return 0
+
+    def _update(self, job_id, status, progress, prompt):
+        with self._condition:
+            job = self.jobs.get(job_id)
+            if job is None:
+                self._seq += 1
+                job = self.jobs[job_id] = {'job_id': job_id, 'seq': self._seq, 'prompt': None,
+                                           'status': None, 'progress': None, 'done': False, 'failed': False,
+                                           'seen_running': False}
+            if prompt:
+                job['prompt'] = prompt
+            if progress is not None:
+                job['progress'] = progress
+            if status:
+                job['status'] = status
+            # Never move a finished job back to pending on a late, out-of-order update
+            job['done'] = job['done'] or status in COMPLETE_STATUSES or progress in (100, '100')
+            job['failed'] = job['failed'] or status in FAILED_STATUSES
+            job['seen_running'] = job['seen_running'] or not (job['done'] or job['failed'])
+            job['updated_at'] = time.time()
+            self._version += 1
+            self._condition.notify_all()
+
+    def _belongs(self, job, mark, prompts, exclude):
+        """Whether a job is one of the submission's: new since `mark`, seen running and, when known, with a submitted prompt"""
+        # Old jobs the archive page loads again arrive already finished, so only count jobs seen running
+        if job['seq'] <= mark or job['job_id'] in exclude or not job['seen_running']:
+            return False
+        return not (prompts and job['prompt']) or prompt_matches(job['prompt'], prompts)
+
+    def jobs_since(self, mark, prompts=None, exclude=None):
+        """Copies of the jobs that belong to a submission made at `mark`, oldest first"""
+        exclude = set(exclude or ())
+        with self._condition:
+            jobs = [dict(job) for job in self.jobs.values() if self._belongs(job, mark, prompts, exclude)]
+        return sorted(jobs, key=lambda job: job['seq'])
+
+    def wait_for_update(self, version, timeout):
+        """Block until a job changes state after `version` or `timeout` seconds pass. Returns the new version.
+
+        Pass 0 the first time and the returned version after that, so updates
+        arriving between two calls aren't missed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def wait_for_jobs(self, mark, expected_jobs, prompts=None, exclude=None, timeout=None, silence_timeout=None):
+        """Block until `expected_jobs` jobs first seen after `mark` have finished.
+
+        Only jobs whose prompt is one of `prompts`, and none in `exclude`,
+        count. Returns their ids, newest first. Failed jobs are dropped with a
+        warning. Returns None if no job event arrives within
+        `silence_timeout` (JOB_TRACKING_SILENCE_TIMEOUT), meaning the traffic
+        isn't being recognised and the caller should fall back to polling.
+        Raises TimeoutError after `timeout` (MAX_IMAGE_WAIT_TIME) seconds.
+        """
+        if timeout is None:
+            timeout = MAX_IMAGE_WAIT_TIME
+        if silence_timeout is None:
+            silence_timeout = JOB_TRACKING_SILENCE_TIMEOUT
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        exclude = set(exclude or ())
+        reported_failures = set()
+        with self._condition:
+            while True:
+                jobs = [job for job in self.jobs.values() if self._belongs(job, mark, prompts, exclude)]
+                for job in jobs:
+                    if job['failed'] and job['job_id'] not in reported_failures:
+                        reported_failures.add(job['job_id'])
+                        print(f"⚠️ Job {job['job_id']} failed: {job['status']}")
+                finished = [job for job in jobs if job['done'] and not job['failed']]
+                settled = [job for job in jobs if job['done'] or job['failed']]
+                if len(finished) >= expected_jobs or (len(jobs) >= expected_jobs and len(settled) == len(jobs)):
+                    elapsed = time.monotonic() - start_time
+                    print(f"✅ {len(finished)}/{expected_jobs} jobs finished after {elapsed:.0f}s")
+                    return [job['job_id'] for job in sorted(finished, key=lambda job: job['seq'], reverse=True)]
+
+                now = time.monotonic()
+                if not jobs and now - start_time >= silence_timeout:
+                    return None
+                if now >= deadline:
+                    raise TimeoutError(
+                        f"Only {len(finished)}/{expected_jobs} jobs finished within {timeout}s "
+                        f"({len(jobs) - len(settled)} still in progress)"
+                    )
+                wake_at = deadline if jobs else min(deadline, start_time + silence_timeout)
+                self._condition.wait(wake_at - now)
+
+    def attach(self, driver):
+        """Listen to the driver's WebSocket frames and job status responses over CDP"""
+        def on_frame(event):
+            if event.response.opcode == 1:  # Text frames only
+                self.feed_text(event.response.payload_data)
+
+        def on_response(request_id, response, event):
+            if re.search(JOB_STATUS_URL_PATTERN, response.url):
+                self._watched_requests[request_id] = response.url
+
+        def on_loading_finished(event):
+            if self._watched_requests.pop(event.request_id, None) is not None:
+                # Bodies are fetched off the event thread, a CDP call from inside a handler would block it
+                self._body_reader.submit(self._read_body, driver, event.request_id)
+
+        self._body_reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-status-reader")
+        driver._tab.add_handler(cdp.network.WebSocketFrameReceived, on_frame)
+        driver.after_response_received(on_response)
+        driver._tab.add_handler(cdp.network.LoadingFinished, on_loading_finished)
+        return self
+
+    def _read_body(self, driver, request_id):
+        try:
+            body, base64_encoded = driver.run_cdp_command(cdp.network.get_response_body(request_id))
+            if not base64_encoded:
+                self.feed_text(body)
+        except Exception as e:
+            logging.error(f"Error reading job status response: {e}")
+
+_trackers = weakref.WeakKeyDictionary()
+
+def get_job_tracker(driver):
+    """The tracker attached to a driver, attaching one on first use"""
+    tracker = _trackers.get(driver)
+    if tracker is None:
+        tracker = _trackers[driver] = JobTracker().attach(driver)
+    return tracker
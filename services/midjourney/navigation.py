@@ -1,21 +1,44 @@
-import time
 import logging
 from config.settings import ORGANIZE_PAGE_URL
 import sys
-from botasaurus.browser import browser, Driver 
+from botasaurus.browser import browser, Driver
+from utils.rate_limiter import get_rate_limiter
+
+# Why the page can't be used right now, or null: a Cloudflare check or a rate limit notice
+PAGE_BLOCKED_JS = r"""
+if (document.querySelector('iframe[src*="challenges.cloudflare.com"], #challenge-form, #cf-challenge-running')
+        || /just a moment/i.test(document.title)) {
+    return 'verification';
+}
+const notices = Array.from(document.querySelectorAll('[role="alert"], [role="status"], [data-sonner-toast], .toast'));
+if (notices.some(el => /too many|rate limit|slow down|try again later/i.test(el.innerText || ''))) {
+    return 'rate limited';
+}
+return null;
+"""
+
+def page_block_reason(driver: Driver):
+    """'verification' or 'rate limited' when the page is in the way of submitting, else None"""
+    try:
+        return driver.run_js(PAGE_BLOCKED_JS)
+    except Exception as e:
+        logging.error(f"Error checking the page state: {e}")
+        return None
 
 def ensure_on_organize_page(driver: Driver):
     """Ensures the browser is on the MidJourney organize page."""
+    limiter = get_rate_limiter("navigation", driver)
     try:
         print("Navigating to the Organize page...")
+        limiter.acquire()
         driver.google_get(ORGANIZE_PAGE_URL, bypass_cloudflare=True)
-        time.sleep(5)
-        
+
         driver.wait_for_element("textarea")
+        limiter.success()
         print("Successfully navigated to the Organize page.")
         return True  # Return a serializable value
 
     except Exception as e:
+        limiter.failure(page_block_reason(driver) or str(e))
         logging.error(f"Error navigating to the Organize page: {e}")
         raise
-
@@ -1,82 +1,59 @@
 import time
+import json
 import logging
 import os
 import shutil
+import threading
 import openpyxl
 from config.settings import (
-    WAIT_TIME_BETWEEN_PROMPTS,
+    PROMPT_ACCEPT_TIMEOUT,
+    PROMPT_BATCH_SUBMIT,
     SEAMLESS_PATTERN_FOLDER,
     DIGITAL_PAPER_FOLDER,
     PROJECT_ROOT,
     BASE_OUTPUT_FOLDER,
-    RAW_FOLDER
+    RAW_FOLDER,
+    SEAM_CHECK_ENABLED,
+    DEDUP_ENABLED,
+    DOWNLOAD_HANDOFF_BUFFERS,
+    JOB_TRACKING_MODE
 )
-from utils.image_processor import process_images, sanitize_name
-from .navigation import ensure_on_organize_page
+from utils.image_processor import process_images, sanitize_name, check_seamless_images
+from utils.dedup import dedup_raw_images
+from utils.listing import create_listing_images
+from .navigation import page_block_reason, PAGE_BLOCKED_JS
 from .download import download_images
+from .generation import wait_for_generation, completed_job_ids
+from .job_tracker import get_job_tracker
+from utils.ledger import get_product_ledger, product_key, stage_reached
+from utils.rate_limiter import get_rate_limiter
 from services.google_drive import upload_to_google_drive
 from botasaurus.browser import Wait
 
-def wait_for_last_image_to_generate(driver):
-    """Waits for images to generate."""
-    fixed_wait_time = 1 * 60  # 1 minute timeout
-    print(f"⏳ Waiting for {fixed_wait_time // 60} minutes to allow images to generate...")
-    time.sleep(fixed_wait_time)
-    print("✅ Timeout reached. Assuming all images are generated.")
+def wait_for_last_image_to_generate(driver, expected_jobs=1, baseline_job_ids=None, tracker=None, mark=None,
+                                    prompts=None):
+    """Waits until the submitted jobs have finished generating.
 
-def send_prompts_to_midjourney(driver, data):
-    """Sends prompts to MidJourney and processes the results."""
-    try:
-        ensure_on_organize_page(driver)
-
-        for entry in data:
-            theme = entry.get("Theme", "").strip()
-            category = entry.get("Category", "").strip()
-            product_type = entry.get("Product Type", "").strip()
-            
-            # Simplified folder naming
-            product_name = f"{theme} - {category} - {product_type}"
-            sanitized_product_name = sanitize_name(product_name)
-            
-            # Determine the correct base folder based on product type
-            base_folder = SEAMLESS_PATTERN_FOLDER if product_type == "Seamless Pattern" else DIGITAL_PAPER_FOLDER
-            
-            # Create the final folder path directly in the correct location
-            processed_folder_path = os.path.join(base_folder, sanitized_product_name)
-            
-            print(f"Sending prompts for: {sanitized_product_name}")
+    With a job tracker the wait ends on the network update that finishes the
+    last job, otherwise the archive page is polled. Returns the new job ids.
+    """
+    print(f"⏳ Waiting for {expected_jobs} jobs to generate...")
+    if tracker is not None:
+        job_ids = tracker.wait_for_jobs(mark, expected_jobs, prompts, exclude=baseline_job_ids)
+        if job_ids is not None:
+            return job_ids
+        print("⚠️ No job updates seen in the network traffic, polling the archive page instead")
+    return wait_for_generation(driver, expected_jobs, baseline_job_ids, prompts=prompts)
 
-            prompts = entry.get("Prompts", [])  # Extract prompts from entry
-            
-            for prompt_idx, prompt in enumerate(prompts):
-                print(f"Submitting Prompt {prompt_idx+1}: {prompt}")
-                try:
-                    driver.type("textarea", prompt)  # Find textarea, clear it, and type prompt
-                    driver.run_js("document.activeElement.blur()")
-                    driver.click("textarea + button")  # Find and click the submit button in one go
-                    time.sleep(WAIT_TIME_BETWEEN_PROMPTS)
-                except Exception as e:
-                    logging.error(f"Error submitting prompt: {e}")
-                    continue
-
-            wait_for_last_image_to_generate(driver)
-
-            raw_folder_path = download_images(driver, sanitized_product_name)
-            process_images(raw_folder_path, processed_folder_path)
-            
-            # Upload to Google Drive immediately after processing
-            share_link = upload_to_google_drive(processed_folder_path)
-            if share_link:
-                print(f"✅ Uploaded to Google Drive: {share_link}")
-            else:
-                print("⚠️ Failed to upload to Google Drive")
-
-    except Exception as e:
-        logging.error(f"Error during prompt submission: {e}")
-        raise
+# Browser workers share the results workbook, so only one may load, fill and save it at a time
+_excel_lock = threading.Lock()
 
 def update_excel_with_results(product_data, raw_folder_path, target_folder, drive_links):
     """Update Excel with results for a single product"""
+    with _excel_lock:
+        _update_excel_with_results(product_data, raw_folder_path, target_folder, drive_links)
+
+def _update_excel_with_results(product_data, raw_folder_path, target_folder, drive_links):
     try:
         print("\n🔍 Debug: Starting Excel update process...")
         results_excel_path = os.path.join(PROJECT_ROOT, "template (4).xlsx")
@@ -110,6 +87,7 @@ def update_excel_with_results(product_data, raw_folder_path, target_folder, driv
         sheet[f'F{target_row}'] = target_folder
         # Store only the folder link
         sheet[f'G{target_row}'] = drive_links['folder_link'] if drive_links else ''
+        sheet[f'H{target_row}'] = product_data.get('Listing Images Folder Path', '')
         
         try:
             workbook.save(results_excel_path)
@@ -123,75 +101,340 @@ def update_excel_with_results(product_data, raw_folder_path, target_folder, driv
         logging.error(f"Error updating Excel file: {e}")
         raise
 
-def process_product(driver, product_data, idx):
-    """Processes a single product with all its prompts at once."""
-    try:
-        print(f"🚀 Starting processing for: {product_data.get('Product Name', '')}")
+def product_folders(product_data):
+    """Prompts, sanitized name, product type, raw folder and processed folder of a product, creating the folders"""
+    theme = product_data.get('Theme', '').strip()
+    category = product_data.get('Category', '').strip()
+    product_type = product_data.get('Product Type', '').strip()
+    prompts = product_data.get('Prompts', [])
+    
+    if not isinstance(prompts, list):
+        prompts = [prompts]
+    
+    # Create single product folder
+    product_name = f"{theme} - {category} - {product_type}"
+    sanitized_product_name = sanitize_name(product_name)
+    
+    # Define paths - Using the product-specific raw folder
+    raw_folder_path = os.path.join(RAW_FOLDER, sanitized_product_name)
+    target_folder = os.path.join(
+        SEAMLESS_PATTERN_FOLDER if product_type == "Seamless Pattern" else DIGITAL_PAPER_FOLDER,
+        sanitized_product_name
+    )
+    
+    # Create folders
+    os.makedirs(raw_folder_path, exist_ok=True)  # Ensure raw folder exists
+    os.makedirs(target_folder, exist_ok=True)
+    return prompts, sanitized_product_name, product_type, raw_folder_path, target_folder
+
+def prompt_box_cleared(driver, prompt, timeout=None):
+    """Whether the prompt box let go of `prompt` within `timeout` (PROMPT_ACCEPT_TIMEOUT) seconds, i.e. it was accepted"""
+    if timeout is None:
+        timeout = PROMPT_ACCEPT_TIMEOUT
+    deadline = time.monotonic() + timeout
+    while True:
+        value = driver.run_js("const box = document.querySelector('textarea'); return box ? box.value : null;")
+        if value is None or value.strip() != prompt.strip():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.25)
+
+def submit_prompt(driver, prompt, max_attempts=3):
+    """Type a prompt into the archive page's prompt box and submit it.
+
+    Submissions are paced by the session's "prompts" rate limiter, which
+    speeds up while the prompt box clears after each submit and backs off
+    when it doesn't. A prompt held up by a verification page or rate limit
+    notice is submitted again after backing off, up to `max_attempts` times.
+    """
+    limiter = get_rate_limiter("prompts", driver)
+    for attempt in range(1, max_attempts + 1):
+        limiter.acquire()
+        driver.type("textarea", prompt)
+        driver.run_js("document.activeElement.blur()")
+        driver.click("textarea + button")
+        if prompt_box_cleared(driver, prompt):
+            limiter.success()
+            return
+        reason = page_block_reason(driver)
+        limiter.failure(reason or "prompt not accepted")
+        if reason is None:
+            # It may still have gone through, submitting again could start the job twice
+            print(f"⚠️ Prompt box didn't clear, slowing down to one prompt per {1 / limiter.rate:.0f}s")
+            return
+        print(f"⚠️ Prompt held up ({reason}), attempt {attempt}/{max_attempts}, "
+              f"slowing down to one prompt per {1 / limiter.rate:.0f}s")
+    raise Exception(f"Prompt was not accepted after {max_attempts} attempts: {prompt}")
+
+# Submits a queue of prompts in one round trip, pausing `gap` ms between them. Each prompt
+# is accepted once the prompt box clears. The queue stops at the first prompt that
+# isn't, so the rest can be retried one by one. Outcomes: accepted, not cleared (may
+# still have gone through), verification, rate limited, no prompt box or not reached.
+SUBMIT_PROMPTS_JS = r"""
+return (async () => {
+const prompts = PROMPTS;
+const gap = GAP_MS;
+const acceptTimeout = ACCEPT_TIMEOUT_MS;
+const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+const blockReason = () => { BLOCK_REASON };
+const setValue = (box, value) => {
+    // Go through the native setter so the page's own input handlers see the change
+    Object.getOwnPropertyDescriptor(HTMLTextAreaElement.prototype, 'value').set.call(box, value);
+    box.dispatchEvent(new Event('input', {bubbles: true}));
+};
+const outcomes = [];
+for (const [i, prompt] of prompts.entries()) {
+    if (i > 0) {
+        await sleep(gap);
+    }
+    const reason = blockReason();
+    const box = document.querySelector('textarea');
+    if (reason || !box) {
+        outcomes.push(reason || 'no prompt box');
+        break;
+    }
+    box.focus();
+    setValue(box, prompt);
+    box.blur();
+    const button = document.querySelector('textarea + button');
+    if (!button) {
+        outcomes.push('no prompt box');
+        break;
+    }
+    button.click();
+    const deadline = Date.now() + acceptTimeout;
+    while (box.isConnected && box.value.trim() === prompt.trim() && Date.now() < deadline) {
+        await sleep(100);
+    }
+    const accepted = !box.isConnected || box.value.trim() !== prompt.trim();
+    outcomes.push(accepted ? 'accepted' : (blockReason() || 'not cleared'));
+    if (!accepted) {
+        break;
+    }
+}
+while (outcomes.length < prompts.length) {
+    outcomes.push('not reached');
+}
+return outcomes;
+})();
+"""
+
+def submit_prompts(driver, prompts):
+    """Submit a product's prompts, all in one browser round trip when PROMPT_BATCH_SUBMIT is on.
+
+    Prompts the batch couldn't submit are retried one at a time with
+    submit_prompt. Stops at the first prompt that can't be submitted.
+    Returns (how many prompts were submitted, the error that stopped it or None).
+    """
+    limiter = get_rate_limiter("prompts", driver)
+    submitted = 0
+    if PROMPT_BATCH_SUBMIT and len(prompts) > 1:
+        limiter.acquire()
+        script = (SUBMIT_PROMPTS_JS
+                  .replace("BLOCK_REASON", PAGE_BLOCKED_JS)
+                  .replace("GAP_MS", str(int(1000 / limiter.rate)))
+                  .replace("ACCEPT_TIMEOUT_MS", str(int(PROMPT_ACCEPT_TIMEOUT * 1000)))
+                  .replace("PROMPTS", json.dumps(list(prompts))))
+        try:
+            timeout = len(prompts) * (1 / limiter.rate + PROMPT_ACCEPT_TIMEOUT) + 30
+            outcomes = driver.run_js(script, timeout=timeout) or []
+        except Exception as e:
+            logging.error(f"Error submitting prompts in one batch: {e}")
+            outcomes = []
+        for prompt, outcome in zip(prompts, outcomes):
+            if outcome == 'accepted':
+                limiter.success()
+            elif outcome == 'not cleared':
+                # It may still have gone through, submitting again could start the job twice
+                limiter.failure("prompt not accepted")
+                print(f"⚠️ Prompt box didn't clear: {prompt}")
+            else:
+                if outcome != 'not reached':
+                    limiter.failure(outcome)
+                break
+            print(f"📝 Submitted prompt {submitted + 1}/{len(prompts)}: {prompt}")
+            submitted += 1
+        if submitted < len(prompts):
+            print(f"⚠️ Batch submitted {submitted}/{len(prompts)} prompts, submitting the rest one by one")
+    
+    for prompt in prompts[submitted:]:
+        try:
+            submit_prompt(driver, prompt)
+        except Exception as e:
+            logging.error(f"Error submitting prompt: {e}")
+            return submitted, e
+        print(f"📝 Submitted prompt {submitted + 1}/{len(prompts)}: {prompt}")
+        submitted += 1
+    return submitted, None
+
+def product_ledger_entry(product_data, ledger=None):
+    """(ledger, key, product name, entry) for a product, entry is None when it has never been started"""
+    if ledger is None:
+        ledger = get_product_ledger()
+    prompts, sanitized_product_name, _, _, _ = product_folders(product_data)
+    key = product_key(sanitized_product_name, prompts)
+    return ledger, key, sanitized_product_name, ledger.get(key)
+
+def finish_product(driver, product_data, job_ids=None, ledger=None):
+    """Download, check, process, build listing images for and upload a product whose jobs have finished.
+
+    With the product's `job_ids` the images are downloaded without touching
+    the page, so this can run off the browser thread. Each stage is recorded
+    in the product ledger and stages it already records are skipped.
+    Returns (product_data, raw_folder_path, target_folder, share_link), raises if the upload fails.
+    """
+    prompts, sanitized_product_name, product_type, raw_folder_path, target_folder = product_folders(product_data)
+    ledger, key, _, entry = product_ledger_entry(product_data, ledger)
+    details = entry['details'] if entry else {}
+    expected_images = len(prompts) * 4  # 4 images per prompt
+    
+    # Verified image bytes are handed straight to the checks and processing below
+    raw_buffers = None
+    if stage_reached(entry, 'downloaded'):
+        raw_folder_path = details['raw_folder_path']
+        print(f"⏭️ Images already downloaded to {raw_folder_path}")
+    else:
+        # Download images - Make sure we're using the product-specific raw folder
+        raw_buffers = {} if DOWNLOAD_HANDOFF_BUFFERS else None
+        downloaded_folder = download_images(
+            driver, sanitized_product_name, expected_count=expected_images, buffers=raw_buffers, job_ids=job_ids
+        )
         
-        theme = product_data.get('Theme', '').strip()
-        category = product_data.get('Category', '').strip()
-        product_type = product_data.get('Product Type', '').strip()
-        prompts = product_data.get('Prompts', [])
+        # Verify the downloaded folder path matches our expected raw folder path
+        if downloaded_folder != raw_folder_path:
+            print(f"⚠️ Warning: Download path mismatch")
+            print(f"Expected: {raw_folder_path}")
+            print(f"Actual: {downloaded_folder}")
+            raw_folder_path = downloaded_folder
+        details = ledger.advance(key, sanitized_product_name, 'downloaded', raw_folder_path=raw_folder_path)
+    
+    if stage_reached(entry, 'processed'):
+        print(f"⏭️ Images already processed into {target_folder}")
+    else:
+        # Drop near-duplicates of images we already have before the expensive stages
+        if DEDUP_ENABLED and os.path.exists(raw_folder_path):
+            dedup_raw_images(raw_folder_path, sanitized_product_name, buffers=raw_buffers)
         
-        if not isinstance(prompts, list):
-            prompts = [prompts]
+        # Drop Seamless Pattern images that don't tile before the resize and upload
+        if product_type == "Seamless Pattern" and SEAM_CHECK_ENABLED and os.path.exists(raw_folder_path):
+            check_seamless_images(raw_folder_path, buffers=raw_buffers)
         
-        # Create single product folder
-        product_name = f"{theme} - {category} - {product_type}"
-        sanitized_product_name = sanitize_name(product_name)
+        # Process all images
+        if os.path.exists(raw_folder_path):
+            results = process_images(raw_folder_path, target_folder, expected_count=expected_images, buffers=raw_buffers)
+            if not any(result['success'] for result in results):
+                raise Exception(f"No images were processed for {sanitized_product_name}")
+            print(f"✅ Processed images for all prompts")
+        else:
+            raise Exception(f"Raw folder not found: {raw_folder_path}")
         
-        # Define paths - Using the product-specific raw folder
-        raw_folder_path = os.path.join(RAW_FOLDER, sanitized_product_name)
-        target_folder = os.path.join(
-            SEAMLESS_PATTERN_FOLDER if product_type == "Seamless Pattern" else DIGITAL_PAPER_FOLDER,
-            sanitized_product_name
+        # Build listing images from the downscaled outputs, written to the results row with the rest
+        listing_folder = create_listing_images(
+            target_folder, sanitized_product_name, seamless=product_type == "Seamless Pattern"
         )
+        details = ledger.advance(key, sanitized_product_name, 'processed',
+                                 target_folder=target_folder, listing_folder=listing_folder)
+    if details.get('listing_folder'):
+        product_data['Listing Images Folder Path'] = details['listing_folder']
+    
+    if stage_reached(entry, 'uploaded'):
+        share_link = details['share_link']
+        print(f"⏭️ Already uploaded to Google Drive: {share_link}")
+    else:
+        # Upload to Google Drive with expected count
+        share_link = upload_to_google_drive(target_folder, expected_count=expected_images)
+        if not share_link:
+            raise Exception("Failed to upload to Google Drive")
+        print(f"✅ Uploaded to Google Drive: {share_link}")
+        ledger.advance(key, sanitized_product_name, 'uploaded', share_link=share_link)
+    
+    return product_data, raw_folder_path, target_folder, share_link
+
+def record_product_result(product_data, raw_folder_path, target_folder, share_link, ledger=None):
+    """Write a finished product to the results workbook and mark it complete in the ledger"""
+    ledger, key, product_name, entry = product_ledger_entry(product_data, ledger)
+    if not stage_reached(entry, 'uploaded'):
+        # Recording it would make the next run skip a product whose images never reached Drive
+        raise Exception(f"{product_name} can't be recorded before it is uploaded")
+    update_excel_with_results(product_data, raw_folder_path, target_folder, share_link)
+    ledger.advance(key, product_name, 'recorded')
+
+def record_product_failure(product_data, error, ledger=None):
+    """Note in the ledger why a product stopped. Its completed stages are kept for the next run."""
+    ledger, key, product_name, _ = product_ledger_entry(product_data, ledger)
+    ledger.record_failure(key, product_name, error)
+
+def process_product(driver, product_data, idx, ledger=None):
+    """Processes a single product with all its prompts at once.
+
+    Resumes after the last stage the product ledger records: prompts
+    already submitted aren't submitted again and finished jobs aren't
+    waited for.
+    """
+    try:
+        print(f"🚀 Starting processing for: {product_data.get('Product Name', '')}")
         
-        # Create folders
-        os.makedirs(raw_folder_path, exist_ok=True)  # Ensure raw folder exists
-        os.makedirs(target_folder, exist_ok=True)
+        prompts, _, _, _, _ = product_folders(product_data)
+        ledger, key, sanitized_product_name, entry = product_ledger_entry(product_data, ledger)
         print(f"Processing {len(prompts)} prompts for: {sanitized_product_name}")
         
         try:
-            # Submit all prompts at once
-            for prompt_idx, prompt in enumerate(prompts, 1):
-                print(f"\n📝 Submitting prompt {prompt_idx}/{len(prompts)}")
-                print(f"Prompt: {prompt}")
-                driver.type("textarea", prompt)
-                driver.run_js("document.activeElement.blur()")
-                driver.click("textarea + button")
-                time.sleep(WAIT_TIME_BETWEEN_PROMPTS)
+            if stage_reached(entry, 'generated'):
+                job_ids = entry['details'].get('job_ids')
+                if job_ids or stage_reached(entry, 'downloaded'):
+                    print(f"⏭️ Jobs already generated: {len(job_ids or [])} job ids recorded")
+                    return finish_product(driver, product_data, job_ids=job_ids, ledger=ledger)
+                # The newest images on the page may be anyone's by now, so find this product's jobs again
+                print("⚠️ Jobs already generated but no job ids were recorded, finding them by their prompts")
+            
+            tracker = get_job_tracker(driver) if JOB_TRACKING_MODE == "network" else None
+            if stage_reached(entry, 'submitted'):
+                # Submitted by a run that stopped while they generated, find them by their prompts
+                print("⏭️ Prompts already submitted, waiting for their jobs")
+                baseline_job_ids = None
+                tracker = None
+                mark = None
+            else:
+                already_submitted = entry['details'].get('prompts_submitted', 0) if entry else 0
+                if already_submitted:
+                    # Some went through before a run stopped, their jobs are found by their prompts as above
+                    print(f"⏭️ {already_submitted}/{len(prompts)} prompts already submitted, submitting the rest")
+                    baseline_job_ids = None
+                    tracker = None
+                    mark = None
+                else:
+                    # Jobs already on the archive page don't count towards this product's
+                    baseline_job_ids = completed_job_ids(driver)
+                    mark = tracker.mark() if tracker else None
+                
+                # Submit all prompts at once
+                remaining = prompts[already_submitted:]
+                print(f"\n📝 Submitting {len(remaining)} prompts")
+                count, error = submit_prompts(driver, remaining)
+                if error is not None:
+                    # Keep track of the ones that went through, the next run only submits the rest
+                    if count:
+                        ledger.update(key, sanitized_product_name, prompts_submitted=already_submitted + count)
+                    raise error
+                ledger.advance(key, sanitized_product_name, 'submitted', prompts=prompts)
             
             # Wait for all images to generate
             expected_images = len(prompts) * 4  # 4 images per prompt
             print(f"\n⏳ Waiting for {expected_images} images to generate...")
-            wait_for_last_image_to_generate(driver)
-            
-            # Download images - Make sure we're using the product-specific raw folder
-            downloaded_folder = download_images(driver, sanitized_product_name, expected_count=expected_images)
+            job_ids = wait_for_last_image_to_generate(driver, len(prompts), baseline_job_ids, tracker, mark, prompts)
             
-            # Verify the downloaded folder path matches our expected raw folder path
-            if downloaded_folder != raw_folder_path:
-                print(f"⚠️ Warning: Download path mismatch")
-                print(f"Expected: {raw_folder_path}")
-                print(f"Actual: {downloaded_folder}")
-                raw_folder_path = downloaded_folder
-            
-            # Process all images
-            if os.path.exists(raw_folder_path):
-                process_images(raw_folder_path, target_folder, expected_count=expected_images)
-                print(f"✅ Processed images for all prompts")
-            else:
-                raise Exception(f"Raw folder not found: {raw_folder_path}")
-            
-            # Upload to Google Drive with expected count
-            share_link = upload_to_google_drive(target_folder, expected_count=expected_images)
-            if share_link:
-                print(f"✅ Uploaded to Google Drive: {share_link}")
-            else:
-                print("⚠️ Failed to upload to Google Drive")
-            
-            return product_data, raw_folder_path, target_folder, share_link
+            # Page job ids are only trusted for downloading when there is exactly one per prompt
+            if tracker is None and len(job_ids) != len(prompts):
+                if baseline_job_ids is None:
+                    # Resumed, so the newest images on the page could be another product's
+                    raise Exception(
+                        f"Found {len(job_ids)} finished jobs matching the prompts of {sanitized_product_name}, "
+                        f"expected {len(prompts)}"
+                    )
+                job_ids = None
+            ledger.advance(key, sanitized_product_name, 'generated', job_ids=job_ids)
+            return finish_product(driver, product_data, job_ids=job_ids, ledger=ledger)
             
         except Exception as e:
             logging.error(f"Error processing prompts: {e}")
@@ -200,4 +443,4 @@ def process_product(driver, product_data, idx):
         
     except Exception as e:
         logging.error(f"Error processing product: {e}")
-        raise 
\ No newline at end of file
+        raise
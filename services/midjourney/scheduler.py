@@ -0,0 +1,310 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config.settings import (
+    WAIT_BETWEEN_IMAGE_CHECKS,
+    MAX_IMAGE_WAIT_TIME,
+    GENERATION_MIN_CHECK_INTERVAL,
+    GENERATION_BACKOFF,
+    JOB_TRACKING_SILENCE_TIMEOUT,
+    PIPELINE_MAX_JOBS_IN_FLIGHT,
+    PIPELINE_FINISH_WORKERS
+)
+from .process import product_folders, submit_prompts, finish_product, product_ledger_entry
+from utils.ledger import get_product_ledger, stage_reached
+from .generation import read_generation_state
+from .job_tracker import prompt_matches
+
+class PipelineScheduler:
+    """Keeps MidJourney's job queue full across products.
+
+    Prompts are submitted in product order whenever fewer than
+    `max_jobs_in_flight` submitted jobs are unfinished, so the next
+    products generate while earlier ones download, process and upload on
+    `finish_workers` background threads. Finished jobs are attributed to the
+    oldest outstanding submission with the same prompt. Jobs whose prompt
+    isn't known or matches no submission, such as ones started by hand or
+    in another tab, are never attributed, but count towards the in-flight
+    limit while they run.
+
+    `products` yields (idx, product_data) pairs. It is only advanced when
+    there is room to submit the next product's prompts, so several
+    schedulers can share one queue of products without hoarding them.
+
+    Products resume after the last stage the product ledger records.
+
+    All browser work and all callbacks run on the calling thread.
+    """
+
+    def __init__(self, driver, products, max_jobs_in_flight=None, finish_workers=None, tracker=None, ledger=None):
+        self.driver = driver
+        self.ledger = ledger or get_product_ledger()
+        self.max_jobs_in_flight = max_jobs_in_flight or PIPELINE_MAX_JOBS_IN_FLIGHT
+        self.finish_workers = finish_workers or PIPELINE_FINISH_WORKERS
+        self.tracker = tracker
+        self.source = iter(products)
+        self.products = []
+        self.queue = deque()
+        self.outstanding = []
+        self.seen_job_ids = set()
+        self.unknown_in_flight = 0
+        self.finishing = {}
+
+    def _take_next_product(self):
+        """Queue the next product's prompts. Returns False when there are no products left."""
+        for idx, product_data in self.source:
+            prompts, _, _, _, _ = product_folders(product_data)
+            _, key, name, entry = product_ledger_entry(product_data, self.ledger)
+            if not prompts or stage_reached(entry, 'recorded'):
+                continue
+            product = {'idx': idx, 'data': product_data, 'name': name, 'key': key, 'prompts': prompts,
+                       'job_ids': [], 'unfinished': len(prompts), 'submitted': 0, 'state': 'queued',
+                       'entry': entry}
+            self.products.append(product)
+            if stage_reached(entry, 'generated'):
+                # Straight to finishing, job ids are kept oldest first until then
+                print(f"\n⏭️ Resuming product {idx + 1} after generation: {name}")
+                product.update(state='generating', unfinished=0,
+                               job_ids=list(reversed(entry['details'].get('job_ids') or [])))
+            elif stage_reached(entry, 'submitted'):
+                # Submitted by a run that stopped while they generated, wait for them without resubmitting
+                print(f"\n⏭️ Resuming product {idx + 1}, prompts already submitted: {name}")
+                product.update(state='generating', submitted=len(prompts))
+                for prompt in prompts:
+                    self.outstanding.append({'product': product, 'prompt': prompt, 'submitted_at': time.monotonic()})
+                    self._claim_finished_baseline_job(prompt)
+            else:
+                # Prompts a stopped run already submitted are waited for, only the rest are queued
+                already_submitted = entry['details'].get('prompts_submitted', 0) if entry else 0
+                if already_submitted:
+                    print(f"\n⏭️ Resuming product {idx + 1}, {already_submitted}/{len(prompts)} prompts "
+                          f"already submitted: {name}")
+                    product.update(state='generating', submitted=already_submitted)
+                    for prompt in prompts[:already_submitted]:
+                        self.outstanding.append({'product': product, 'prompt': prompt, 'submitted_at': time.monotonic()})
+                        self._claim_finished_baseline_job(prompt)
+                self.queue.extend((product, prompt) for prompt in prompts[already_submitted:])
+            return True
+        self.source = iter(())
+        return False
+
+    def _submit_ready_prompts(self):
+        """Submit queued prompts until the in-flight limit is reached. Returns how many were submitted."""
+        submitted = 0
+        while len(self.outstanding) + self.unknown_in_flight < self.max_jobs_in_flight:
+            if not self.queue:
+                # Resumed products are taken without queuing any prompts
+                if not self._take_next_product():
+                    break
+                continue
+            # As many of the next product's prompts as there is room for, submitted together
+            product = self.queue[0][0]
+            room = self.max_jobs_in_flight - len(self.outstanding) - self.unknown_in_flight
+            batch = []
+            while self.queue and self.queue[0][0] is product and len(batch) < room:
+                batch.append(self.queue.popleft()[1])
+            if product['state'] == 'failed':
+                continue
+            if product['state'] == 'queued':
+                product['state'] = 'generating'
+                print(f"\n🚀 Submitting prompts for product {product['idx'] + 1}: {product['name']}")
+            count, error = submit_prompts(self.driver, batch)
+            for prompt in batch[:count]:
+                self.outstanding.append({'product': product, 'prompt': prompt, 'submitted_at': time.monotonic()})
+            product['submitted'] += count
+            submitted += count
+            if count and product['submitted'] < len(product['prompts']):
+                # So a restart doesn't submit these again
+                self.ledger.update(product['key'], product['name'], prompts_submitted=product['submitted'])
+            if error is not None:
+                self._fail(product, error)
+                continue
+            if product['submitted'] == len(product['prompts']):
+                self.ledger.advance(product['key'], product['name'], 'submitted', prompts=product['prompts'])
+            print(f"📨 {len(self.outstanding) + self.unknown_in_flight}/{self.max_jobs_in_flight} jobs in flight")
+        return submitted
+
+    def _read_jobs(self):
+        """Jobs since the scheduler started: (job id, prompt, failed) for finished ones, (job id, prompt) for running ones"""
+        if self.tracker is not None:
+            jobs = self.tracker.jobs_since(self.mark, exclude=self.baseline_job_ids)
+            return ([(job['job_id'], job['prompt'], job['failed']) for job in jobs if job['done'] or job['failed']],
+                    [(job['job_id'], job['prompt']) for job in jobs if not (job['done'] or job['failed'])])
+        state = read_generation_state(self.driver)
+        return ([(job_id, state['prompts'].get(job_id), False) for job_id in state['complete'] - self.baseline_job_ids],
+                [(job_id, state['prompts'].get(job_id)) for job_id in state['pending'] - self.baseline_job_ids])
+
+    def _claim_finished_baseline_job(self, prompt):
+        """Attribute the newest job that had already finished with `prompt` when the run started, if any"""
+        for job_id in self.baseline['order']:
+            job_prompt = self.baseline['prompts'].get(job_id)
+            if (job_id in self.baseline['complete'] and job_id not in self.seen_job_ids
+                    and job_prompt and prompt_matches(job_prompt, [prompt])):
+                self.seen_job_ids.add(job_id)
+                self._attribute(job_id, job_prompt, False)
+                return
+
+    def _matching_submission(self, prompt):
+        """The oldest outstanding submission of `prompt`, or None. A job without a known prompt matches none."""
+        if not prompt:
+            return None
+        for candidate in self.outstanding:
+            if prompt_matches(prompt, [candidate['prompt']]):
+                return candidate
+        return None
+
+    def _attribute(self, job_id, prompt, failed):
+        """Match a finished job to its submission. Returns whether it was one of ours."""
+        submission = self._matching_submission(prompt)
+        if submission is None:
+            return False
+        self.outstanding.remove(submission)
+        product = submission['product']
+        product['unfinished'] -= 1
+        if failed:
+            print(f"⚠️ Job {job_id} for {product['name']} failed")
+        else:
+            product['job_ids'].append(job_id)
+        return True
+
+    def _collect_finished_jobs(self):
+        """Attribute newly finished jobs. Returns how many were ours."""
+        try:
+            finished_jobs, running_jobs = self._read_jobs()
+        except Exception as e:
+            # A page reload or verification screen in the way, try again on the next check
+            logging.error(f"Error reading finished jobs: {e}")
+            return 0
+        # Running jobs that aren't ours still take up MidJourney's queue
+        self.unknown_in_flight = sum(1 for _, prompt in running_jobs if self._matching_submission(prompt) is None)
+        attributed = 0
+        for job_id, prompt, failed in finished_jobs:
+            if job_id in self.seen_job_ids:
+                continue
+            if not prompt:
+                # Its prompt may be known by the next check, until then it could be anyone's
+                continue
+            self.seen_job_ids.add(job_id)
+            if self._attribute(job_id, prompt, failed):
+                attributed += 1
+        return attributed
+
+    def _fail(self, product, error):
+        if product['state'] == 'failed':
+            return
+        product['state'] = 'failed'
+        product['error'] = error
+        # Its remaining jobs no longer hold up the queue
+        self.outstanding = [s for s in self.outstanding if s['product'] is not product]
+        self.failures.append(product)
+
+    def _expire_stale_submissions(self):
+        now = time.monotonic()
+        for submission in list(self.outstanding):
+            if now - submission['submitted_at'] > MAX_IMAGE_WAIT_TIME:
+                product = submission['product']
+                self._fail(product, TimeoutError(
+                    f"Job for '{submission['prompt']}' didn't finish within {MAX_IMAGE_WAIT_TIME}s"
+                ))
+
+    def _start_finished_products(self, executor):
+        for product in self.products:
+            if product['state'] != 'generating' or product['unfinished']:
+                continue
+            if any(queued is product for queued, _ in self.queue):
+                continue
+            job_ids = list(reversed(product['job_ids']))
+            if not job_ids and not stage_reached(product['entry'], 'downloaded'):
+                # Without job ids finish_product would scrape the page from its own thread, racing this one
+                # for the browser and picking up whatever images are newest, possibly another product's
+                self._fail(product, Exception(
+                    "No job ids to download, all jobs failed or none were recorded "
+                    "(run it with PIPELINE_ENABLED = False to find its jobs by their prompts)"
+                ))
+                continue
+            product['state'] = 'finishing'
+            print(f"\n✅ All jobs finished for product {product['idx'] + 1}: {product['name']}")
+            # A product resumed past generation keeps its later stage, or finish_product would redo them
+            if not stage_reached(product['entry'], 'generated'):
+                self.ledger.advance(product['key'], product['name'], 'generated', job_ids=job_ids)
+            # finish_product doesn't touch the page when given job ids, so it can run off the browser thread
+            future = executor.submit(finish_product, self.driver, product['data'], job_ids, self.ledger)
+            self.finishing[future] = product
+
+    def _wait(self, interval):
+        """Sleep until the next check, waking early on job updates or finished products"""
+        if self.tracker is not None:
+            self.tracker_version = self.tracker.wait_for_update(self.tracker_version, interval)
+        elif self.finishing and not self.outstanding:
+            wait(self.finishing, timeout=interval, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(interval)
+
+    def run(self, on_result, on_failure):
+        """Run every product through the pipeline.
+
+        on_result(idx, product_data, raw_folder_path, target_folder, share_link)
+        is called as each product completes, on_failure(idx, error) as each
+        fails. When on_failure returns False no further prompts are
+        submitted and the products already in flight are drained.
+        """
+        self.failures = []
+        try:
+            # Prompts of the finished jobs too, so resumed products can claim theirs
+            self.baseline = read_generation_state(self.driver)
+        except Exception as e:
+            logging.error(f"Error reading generation state: {e}")
+            self.baseline = {'complete': set(), 'prompts': {}, 'order': []}
+        self.baseline_job_ids = self.baseline['complete']
+        self.mark = self.tracker.mark() if self.tracker is not None else None
+        self.tracker_version = 0
+        started_at = time.monotonic()
+        interval = GENERATION_MIN_CHECK_INTERVAL
+        stopping = False
+
+        with ThreadPoolExecutor(max_workers=self.finish_workers, thread_name_prefix="finish-product") as executor:
+            while True:
+                # Collect first, so jobs that aren't ours are counted before there's room to submit
+                progress = self._collect_finished_jobs()
+                if not stopping:
+                    progress += self._submit_ready_prompts()
+                self._expire_stale_submissions()
+                self._start_finished_products(executor)
+
+                if (self.tracker is not None and not self.seen_job_ids and self.outstanding
+                        and time.monotonic() - started_at > JOB_TRACKING_SILENCE_TIMEOUT):
+                    print("⚠️ No job updates seen in the network traffic, polling the archive page instead")
+                    self.tracker = None
+
+                for future in [f for f in self.finishing if f.done()]:
+                    product = self.finishing.pop(future)
+                    progress += 1
+                    try:
+                        product_data, raw_folder_path, target_folder, share_link = future.result()
+                        product['state'] = 'done'
+                        on_result(product['idx'], product_data, raw_folder_path, target_folder, share_link)
+                    except Exception as e:
+                        self._fail(product, e)
+
+                while self.failures:
+                    product = self.failures.pop(0)
+                    logging.error(f"Product {product['idx'] + 1} failed: {product['error']}")
+                    self.ledger.record_failure(product['key'], product['name'], product['error'])
+                    if on_failure(product['idx'], product['error']) is False and not stopping:
+                        stopping = True
+                        for queued, _ in self.queue:
+                            if queued['state'] != 'failed':
+                                queued['state'] = 'stopped'
+                        self.queue.clear()
+                        self.source = iter(())
+                        print("\n🛑 No more prompts will be submitted, finishing the products in flight")
+
+                if not (self.queue or self.outstanding or self.finishing) and (stopping or not self._take_next_product()):
+                    break
+                interval = GENERATION_MIN_CHECK_INTERVAL if progress else min(
+                    interval * GENERATION_BACKOFF, WAIT_BETWEEN_IMAGE_CHECKS
+                )
+                self._wait(interval)
+
+        return [product['state'] for product in self.products]
@@ -0,0 +1,181 @@
+from PIL import Image
+import numpy as np
+import os
+import json
+import logging
+import threading
+from config.settings import PHASH_INDEX_FILE, DEDUP_MAX_DISTANCE
+from utils.manifest import manifest_filenames, update_manifest_entries
+from utils.image_processor import open_source_image
+
+HASH_SIZE = 8  # 64-bit hashes
+PHASH_SAMPLE_SIZE = HASH_SIZE * 4
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, so a 2D DCT is two matrix products"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    basis = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    basis[0] /= np.sqrt(2)
+    return basis.astype(np.float32)
+
+_DCT = _dct_matrix(PHASH_SAMPLE_SIZE)
+
+def _bits_to_ints(bits):
+    """Pack an (N, 64) boolean array into N Python ints"""
+    packed = np.packbits(bits.astype(np.uint8), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+def phash(grays):
+    """DCT perceptual hashes for an (N, PHASH_SAMPLE_SIZE, PHASH_SAMPLE_SIZE) grayscale array"""
+    coefficients = np.einsum('ij,njk,lk->nil', _DCT, grays, _DCT)
+    low = coefficients[:, :HASH_SIZE, :HASH_SIZE].reshape(len(grays), -1)
+    # Compare against the median of the low frequencies, ignoring the DC term
+    medians = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _bits_to_ints(low > medians)
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def load_gray_thumbnails(folder, filenames, size, buffers=None):
+    """Grayscale thumbnails stacked into one (N, height, width) float array, plus the filenames loaded"""
+    thumbnails = []
+    loaded = []
+    for filename in filenames:
+        try:
+            source_bytes = buffers.get(filename) if buffers else None
+            with open_source_image(os.path.join(folder, filename), source_bytes) as img:
+                img.draft('L', size)
+                thumbnail = img.convert('L').resize(size, Image.Resampling.BOX)
+            thumbnails.append(np.asarray(thumbnail, dtype=np.float32))
+            loaded.append(filename)
+        except Exception as e:
+            print(f"❌ Error loading {filename} for dedup: {e}")
+            logging.error(f"Error loading {filename} for dedup: {e}")
+    if not thumbnails:
+        return np.empty((0, size[1], size[0]), dtype=np.float32), loaded
+    return np.stack(thumbnails), loaded
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes, searchable by Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, hash_value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, [item], {}]
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """All (distance, item) pairs within max_distance, closest first"""
+        matches = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            # Triangle inequality: only children at distance d +/- max_distance can match
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+class PerceptualHashIndex:
+    """pHash index of downloaded images, persisted across runs as JSON"""
+
+    def __init__(self, index_file=PHASH_INDEX_FILE):
+        self.index_file = index_file
+        self.entries = []
+        self.tree = BKTree()
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    for entry in json.load(f):
+                        self._add(entry)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error reading perceptual hash index {index_file}: {e}")
+
+    def _add(self, entry):
+        self.entries.append(entry)
+        self.tree.add(int(entry['phash'], 16), entry)
+
+    def add(self, hash_value, path, product):
+        self._add({'phash': f"{hash_value:016x}", 'path': path, 'product': product})
+
+    def find_duplicate(self, hash_value, path, max_distance):
+        """Closest indexed image within max_distance, ignoring the image at `path` itself"""
+        for distance, entry in self.tree.search(hash_value, max_distance):
+            if entry['path'] != path:
+                return distance, entry
+        return None
+
+    def contains(self, hash_value, path):
+        return any(entry['path'] == path for _, entry in self.tree.search(hash_value, 0))
+
+    def save(self):
+        temp_path = f"{self.index_file}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.index_file)
+
+# Products finishing on different threads share the index file
+_index_lock = threading.Lock()
+
+def dedup_raw_images(raw_folder_path, product_name, max_distance=None, index=None, buffers=None):
+    """Mark near-duplicate raw images as skipped in the download manifest.
+
+    Images are compared against each other and against every image indexed
+    by earlier runs. The newest copy in manifest order is the one kept when
+    duplicates arrive together. Returns {filename: (distance, duplicate path)}.
+    """
+    if max_distance is None:
+        max_distance = DEDUP_MAX_DISTANCE
+
+    filenames = manifest_filenames(raw_folder_path)
+    if filenames is None:
+        print(f"⚠️ No manifest in {raw_folder_path}, skipping duplicate check")
+        return {}
+    if not filenames:
+        return {}
+
+    print(f"\n🔎 Checking {len(filenames)} images for near-duplicates...")
+    grays, loaded = load_gray_thumbnails(raw_folder_path, filenames, (PHASH_SAMPLE_SIZE, PHASH_SAMPLE_SIZE), buffers)
+    hashes = phash(grays) if len(grays) else []
+
+    duplicates = {}
+    updates = {}
+    with _index_lock:
+        # Load inside the lock so another product's additions aren't lost when this one saves
+        if index is None:
+            index = PerceptualHashIndex()
+        for filename, hash_value in zip(loaded, hashes):
+            path = os.path.join(raw_folder_path, filename)
+            match = index.find_duplicate(hash_value, path, max_distance)
+            updates[filename] = {'phash': f"{hash_value:016x}"}
+            if match:
+                distance, entry = match
+                duplicates[filename] = (distance, entry['path'])
+                updates[filename].update({'skipped': 'duplicate', 'duplicate_of': entry['path']})
+                print(f"⚠️ Skipping {filename}: {distance} bits from {entry['path']}")
+            elif not index.contains(hash_value, path):
+                index.add(hash_value, path, product_name)
+        index.save()
+
+    update_manifest_entries(raw_folder_path, updates)
+    print(f"✅ {len(loaded) - len(duplicates)}/{len(loaded)} images are unique")
+    return duplicates
@@ -0,0 +1,86 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from config.settings import DOWNLOAD_INDEX_DB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    job_id TEXT NOT NULL,
+    image_index INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    local_path TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    product TEXT,
+    downloaded_at TEXT,
+    PRIMARY KEY (job_id, image_index)
+);
+CREATE INDEX IF NOT EXISTS downloads_by_product ON downloads (product);
+"""
+
+COLUMNS = ('job_id', 'image_index', 'url', 'local_path', 'size', 'sha256', 'product', 'downloaded_at')
+
+class DownloadIndex:
+    """SQLite index of downloaded images, keyed by MidJourney job id and image index.
+
+    Lookups by job use the primary key, lookups by product their own index.
+    Safe to share between threads.
+    """
+
+    def __init__(self, db_path=DOWNLOAD_INDEX_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            # WAL keeps readers from blocking while a run records its downloads
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._connection.execute(sql, params)]
+
+    def get(self, job_id, image_index):
+        """The indexed download of one image, or None"""
+        rows = self._query("SELECT * FROM downloads WHERE job_id = ? AND image_index = ?", (job_id, image_index))
+        return rows[0] if rows else None
+
+    def by_job(self, job_id):
+        return self._query("SELECT * FROM downloads WHERE job_id = ? ORDER BY image_index", (job_id,))
+
+    def by_product(self, product):
+        return self._query("SELECT * FROM downloads WHERE product = ? ORDER BY downloaded_at DESC", (product,))
+
+    def record(self, job_id, image_index, url, local_path, size, sha256, product, downloaded_at=None):
+        """Add or replace the entry for an image"""
+        if downloaded_at is None:
+            downloaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        row = (job_id, image_index, url, local_path, size, sha256, product, downloaded_at)
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    f"INSERT OR REPLACE INTO downloads ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    row
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error recording {url} in download index: {e}")
+
+    def find_local_copy(self, job_id, image_index):
+        """The indexed entry for an image if its file is still on disk with the recorded size"""
+        entry = self.get(job_id, image_index)
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(entry['local_path']) != entry['size']:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
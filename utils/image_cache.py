@@ -0,0 +1,91 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from config.settings import PROCESSED_CACHE_FOLDER, PROCESSED_CACHE_MAX_MB
+
+def hash_file(filepath, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_key(raw_hash, params):
+    """Cache key for a raw image hash processed with the given parameters"""
+    encoded_params = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(f"{raw_hash}:{encoded_params}".encode('utf-8')).hexdigest()
+
+def _cache_path(key, extension, cache_folder=PROCESSED_CACHE_FOLDER):
+    return os.path.join(cache_folder, key[:2], f"{key}{extension}")
+
+def _link_or_copy(source, destination):
+    """Hard link source to destination, falling back to a copy across filesystems"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def fetch_cached_output(key, output_path, cache_folder=PROCESSED_CACHE_FOLDER):
+    """Place a cached output at output_path. Returns True on a cache hit."""
+    cached_path = _cache_path(key, os.path.splitext(output_path)[1], cache_folder)
+    if not os.path.exists(cached_path):
+        return False
+    try:
+        _link_or_copy(cached_path, output_path)
+        # Bump the modification time so eviction drops least recently used entries first
+        os.utime(cached_path)
+        return True
+    except OSError as e:
+        logging.error(f"Error reading cached output {cached_path}: {e}")
+        return False
+
+def store_cached_output(key, output_path, cache_folder=PROCESSED_CACHE_FOLDER):
+    """Add a freshly processed output to the cache"""
+    cached_path = _cache_path(key, os.path.splitext(output_path)[1], cache_folder)
+    try:
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        temp_path = f"{cached_path}.{os.getpid()}.tmp"
+        _link_or_copy(output_path, temp_path)
+        # Atomic so concurrent workers never see a half-written entry
+        os.replace(temp_path, cached_path)
+    except OSError as e:
+        logging.error(f"Error caching output {output_path}: {e}")
+
+def evict_cache(max_mb=PROCESSED_CACHE_MAX_MB, cache_folder=PROCESSED_CACHE_FOLDER):
+    """Delete least recently used cache entries until the cache fits in max_mb"""
+    if not os.path.isdir(cache_folder):
+        return 0
+
+    entries = []
+    total_bytes = 0
+    for root, _, files in os.walk(cache_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+    max_bytes = max_mb * 1024 * 1024
+    removed_count = 0
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            # Outputs hard linked from this entry keep their own link and are unaffected
+            os.remove(path)
+            total_bytes -= size
+            removed_count += 1
+        except OSError as e:
+            logging.error(f"Error evicting cache entry {path}: {e}")
+
+    if removed_count:
+        print(f"🧹 Evicted {removed_count} entries from the processed image cache")
+    return removed_count
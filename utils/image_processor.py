@@ -1,67 +1,532 @@
 from PIL import Image
+import numpy as np
 import os
+import io
+import sys
+import time
+import hashlib
 import shutil
 import pathlib
 import logging
 import subprocess
-from config.settings import SEAMLESS_PATTERN_FOLDER, DIGITAL_PAPER_FOLDER
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from config.settings import (
+    SEAMLESS_PATTERN_FOLDER,
+    DIGITAL_PAPER_FOLDER,
+    IMAGE_PROCESS_WORKERS,
+    IMAGE_PROCESS_MEMORY_BUDGET_MB,
+    PROCESSED_CACHE_ENABLED,
+    OUTPUT_PROFILES,
+    ENCODE_PROFILES,
+    ENCODE_PROFILE,
+    SEAM_CHECK_SIZE,
+    SEAM_CHECK_MAX_SCORE
+)
+from utils.image_cache import hash_file, cache_key, fetch_cached_output, store_cached_output, evict_cache
+from utils.manifest import manifest_filenames, write_manifest, update_manifest_entries
+
+# Products are processed on finish threads while the browser and downloads run on others. Forking a
+# multi-threaded process can copy a lock some other thread holds, so workers are spawned fresh instead.
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+FORMAT_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp'}
+EXTENSION_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG', '.webp': 'WEBP'}
 
 def sanitize_name(name):
     return "".join(c for c in name if c.isalnum() or c in (" ", "-", "_")).strip()
 
-def process_images(raw_folder_path, target_folder, expected_count=None):
-    """Process images in the raw folder with count verification"""
+def peak_rss_mb():
+    """Peak resident memory of the current process in MB, or None if it can't be measured"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def open_source_image(input_path, source_bytes=None):
+    """Open a raw image from bytes already in memory when we have them, otherwise from disk"""
+    if source_bytes is not None:
+        return Image.open(io.BytesIO(source_bytes))
+    return Image.open(input_path)
+
+def get_encode_profile(profile):
+    """Encode settings for an output profile"""
+    return ENCODE_PROFILES[profile.get('encode') or ENCODE_PROFILE]
+
+def resolve_output_format(filename, profile):
+    """Pillow format a profile's output is written in"""
+    output_format = profile.get('format') or EXTENSION_FORMATS.get(os.path.splitext(filename)[1].lower(), 'PNG')
+    if output_format == 'PNG' and get_encode_profile(profile)['lossless_format'] == 'WEBP':
+        output_format = 'WEBP'
+    return output_format
+
+def profile_output_path(target_folder, filename, profile):
+    """Where a profile's output for a raw file is written"""
+    folder = os.path.join(target_folder, profile['folder']) if profile.get('folder') else target_folder
+    base, extension = os.path.splitext(filename)
+    output_format = resolve_output_format(filename, profile)
+    if EXTENSION_FORMATS.get(extension.lower()) != output_format:
+        extension = FORMAT_EXTENSIONS[output_format]
+    return os.path.join(folder, f"{base}{extension}")
+
+def encoder_options(output_format, profile, encode=None):
+    """Keyword arguments for Image.save() for a profile in the given format"""
+    if encode is None:
+        encode = get_encode_profile(profile)
+    if output_format == 'PNG':
+        # optimize=True always compresses at level 9
+        return {
+            'compress_level': encode['png_compress_level'],
+            'optimize': encode['png_optimize'],
+            'dpi': profile['dpi']
+        }
+    if output_format == 'WEBP':
+        return {
+            'lossless': True,
+            'quality': 100,  # For lossless WebP this is compression effort, not fidelity
+            'method': encode['webp_method']
+        }
+    return {
+        'quality': profile['quality'],  # High quality for JPEGs
+        'subsampling': encode['jpeg_subsampling'],
+        'progressive': encode['jpeg_progressive'],
+        'optimize': encode['jpeg_optimize'],
+        'dpi': profile['dpi']
+    }
+
+def estimate_image_memory_mb(input_path, profiles=OUTPUT_PROFILES, source_bytes=None):
+    """Estimate the memory needed to process one image, reading only its header.
+
+    Counts the decoded source, the intermediate buffer of the two-pass resize,
+    the output buffer of every profile and, when the image was handed over
+    in memory, its compressed bytes.
+    """
+    largest_size = profiles[0]['size']
+    with open_source_image(input_path, source_bytes) as img:
+        # draft() only changes what will be decoded (JPEG DCT scaling), nothing is loaded yet
+        img.draft(img.mode, largest_size)
+        width, height = img.size
+        bands = len(img.getbands())
+    decoded_bytes = width * height * bands
+    intermediate_bytes = largest_size[0] * height * bands
+    output_bytes = sum(p['size'][0] * p['size'][1] * bands for p in profiles)
+    handoff_bytes = len(source_bytes) if source_bytes is not None else 0
+    return (decoded_bytes + intermediate_bytes + output_bytes + handoff_bytes) / (1024 * 1024)
+
+def processing_params(profiles, profile_idx, output_path, memory_bounded=False):
+    """Everything that affects the bytes of a processed image, used to key the output cache.
+
+    Derived profiles depend on the profiles they may be derived from, so the
+    whole chain up to profile_idx is included.
+    """
+    return {
+        'chain': [
+            {
+                'size': p['size'],
+                'dpi': p['dpi'],
+                'quality': p['quality'],
+                'format': p.get('format'),
+                'encode': get_encode_profile(p)
+            }
+            for p in profiles[:profile_idx + 1]
+        ],
+        'resample': 'LANCZOS',
+        'format': os.path.splitext(output_path)[1].lower(),
+        'memory_bounded': memory_bounded
+    }
+
+def _pick_derivation_source(candidates, size):
+    """Smallest decoded image still at least `size`, or the largest one when all are smaller"""
+    large_enough = [img for img in candidates if img.width >= size[0] and img.height >= size[1]]
+    if large_enough:
+        return min(large_enough, key=lambda img: img.width * img.height)
+    return max(candidates, key=lambda img: img.width * img.height)
+
+def _save_profile_output(img, output_path, profile):
+    """Encode one profile's output"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # The output may be a hard link into the cache, so never write through it
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    output_format = EXTENSION_FORMATS[os.path.splitext(output_path)[1].lower()]
+    if output_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+        # JPEG has no alpha channel, flatten onto white
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.convert('RGBA').getchannel('A'))
+        img = background
+    img.save(output_path, format=output_format, **encoder_options(output_format, profile))
+
+def process_single_image(input_path, output_paths, profiles=OUTPUT_PROFILES, memory_bounded=False, use_cache=False,
+                         source_bytes=None):
+    """Decode a raw image once and write every profile's output.
+
+    output_paths lines up with profiles. source_bytes, when given, is the raw
+    image already in memory and input_path is not read. Runs in a worker
+    process when processing in parallel.
+    """
+    filename = os.path.basename(input_path)
+    start_time = time.perf_counter()
+    cached_count = 0
+    try:
+        keys = [None] * len(profiles)
+        pending = list(range(len(profiles)))
+        if use_cache:
+            raw_hash = hashlib.sha256(source_bytes).hexdigest() if source_bytes is not None else hash_file(input_path)
+            pending = []
+            for idx, output_path in enumerate(output_paths):
+                keys[idx] = cache_key(raw_hash, processing_params(profiles, idx, output_path, memory_bounded))
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                if fetch_cached_output(keys[idx], output_path):
+                    cached_count += 1
+                else:
+                    pending.append(idx)
+
+        if pending:
+            # Process using PIL
+            with open_source_image(input_path, source_bytes) as img:
+                if memory_bounded:
+                    # Let JPEG sources decode at the smallest scale still >= the largest profile
+                    img.draft(img.mode, profiles[0]['size'])
+                img.load()
+                candidates = [img]
+                for idx, profile in enumerate(profiles):
+                    source = _pick_derivation_source(candidates, profile['size'])
+                    if memory_bounded:
+                        # Shrink large sources with reduce() before Lanczos so fewer full-size rows are held
+                        derived = source.resize(profile['size'], Image.Resampling.LANCZOS, reducing_gap=2.0)
+                    else:
+                        derived = source.resize(profile['size'], Image.Resampling.LANCZOS)
+                    candidates.append(derived)
+                    if idx in pending:
+                        _save_profile_output(derived, output_paths[idx], profile)
+                        if keys[idx]:
+                            store_cached_output(keys[idx], output_paths[idx])
+            for derived in candidates[1:]:
+                derived.close()
+
+        return {
+            'filename': filename,
+            'output_path': output_paths[0],
+            'outputs': {profile['name']: path for profile, path in zip(profiles, output_paths)},
+            'success': True,
+            'cached': not pending,
+            'cached_outputs': cached_count,
+            'error': None,
+            'elapsed': time.perf_counter() - start_time,
+            'pid': os.getpid(),
+            'peak_rss_mb': peak_rss_mb()
+        }
+    except Exception as e:
+        return {
+            'filename': filename,
+            'output_path': output_paths[0],
+            'outputs': {},
+            'success': False,
+            'cached': False,
+            'cached_outputs': cached_count,
+            'error': str(e),
+            'elapsed': time.perf_counter() - start_time,
+            'pid': os.getpid(),
+            'peak_rss_mb': peak_rss_mb()
+        }
+
+def measure_encode_profiles(sample_path, size=(3600, 3600), encode_profiles=None):
+    """Time and size every encode profile on one sample image, in memory.
+
+    Each profile is measured in the lossless format it selects and as JPEG.
+    Prints a time-versus-size table and returns its rows.
+    """
+    if encode_profiles is None:
+        encode_profiles = ENCODE_PROFILES
+    with Image.open(sample_path) as img:
+        resized = img.resize(size, Image.Resampling.LANCZOS)
+
+    rows = []
+    for name, encode in encode_profiles.items():
+        for output_format in (encode['lossless_format'], 'JPEG'):
+            profile = {'dpi': (300, 300), 'quality': 95}
+            image = resized.convert('RGB') if output_format == 'JPEG' else resized
+            buffer = io.BytesIO()
+            start_time = time.perf_counter()
+            image.save(buffer, format=output_format, **encoder_options(output_format, profile, encode))
+            rows.append({
+                'profile': name,
+                'format': output_format,
+                'seconds': time.perf_counter() - start_time,
+                'bytes': buffer.tell()
+            })
+
+    print(f"\n{'profile':<10} {'format':<6} {'seconds':>8} {'MB':>8}")
+    for row in rows:
+        print(f"{row['profile']:<10} {row['format']:<6} {row['seconds']:>8.2f} {row['bytes'] / (1024 * 1024):>8.2f}")
+    return rows
+
+def load_seam_thumbnails(raw_folder_path, filenames, size=SEAM_CHECK_SIZE, buffers=None):
+    """Downscaled RGB copies of the images stacked into one (N, size, size, 3) float array.
+
+    Returns the array and the filenames that could be loaded, in the same order.
+    """
+    thumbnails = []
+    loaded = []
+    for filename in filenames:
+        try:
+            source_bytes = buffers.get(filename) if buffers else None
+            with open_source_image(os.path.join(raw_folder_path, filename), source_bytes) as img:
+                # JPEG sources can decode straight at a reduced scale
+                img.draft('RGB', (size, size))
+                thumbnail = img.convert('RGB').resize((size, size), Image.Resampling.BOX)
+            thumbnails.append(np.asarray(thumbnail, dtype=np.float32))
+            loaded.append(filename)
+        except Exception as e:
+            print(f"❌ Error loading {filename} for seam check: {e}")
+            logging.error(f"Error loading {filename} for seam check: {e}")
+    if not thumbnails:
+        return np.empty((0, size, size, 3), dtype=np.float32), loaded
+    return np.stack(thumbnails), loaded
+
+def seam_scores(thumbnails):
+    """Score how well each image wraps around, for a (N, H, W, C) array.
+
+    The difference across each wrap seam (right edge against left edge,
+    bottom against top) is divided by the image's typical difference between
+    neighbouring columns or rows, so busy textures aren't penalised. A clean
+    wrap scores about 1, the worse of the two seams is returned.
+    """
+    if len(thumbnails) == 0:
+        return np.empty(0, dtype=np.float32)
+    epsilon = 1e-6
+    horizontal_seam = np.abs(thumbnails[:, :, -1, :] - thumbnails[:, :, 0, :]).mean(axis=(1, 2))
+    vertical_seam = np.abs(thumbnails[:, -1, :, :] - thumbnails[:, 0, :, :]).mean(axis=(1, 2))
+    horizontal_typical = np.abs(np.diff(thumbnails, axis=2)).mean(axis=(1, 2, 3))
+    vertical_typical = np.abs(np.diff(thumbnails, axis=1)).mean(axis=(1, 2, 3))
+    return np.maximum(
+        horizontal_seam / (horizontal_typical + epsilon),
+        vertical_seam / (vertical_typical + epsilon)
+    )
+
+def check_seamless_images(raw_folder_path, max_score=None, buffers=None):
+    """Seam check a product's raw images and mark the ones that don't tile as skipped.
+
+    Works from the download manifest, so rejected images are left out of
+    process_images and the Drive upload. Returns {filename: score}.
+    """
+    if max_score is None:
+        max_score = SEAM_CHECK_MAX_SCORE
+
+    filenames = manifest_filenames(raw_folder_path)
+    if filenames is None:
+        print(f"⚠️ No manifest in {raw_folder_path}, skipping seam check")
+        return {}
+    if not filenames:
+        return {}
+
+    print(f"\n🧩 Checking {len(filenames)} images for seamless tiling...")
+    thumbnails, loaded = load_seam_thumbnails(raw_folder_path, filenames, buffers=buffers)
+    scores = dict(zip(loaded, seam_scores(thumbnails).tolist()))
+
+    updates = {}
+    for filename, score in scores.items():
+        updates[filename] = {'seam_score': round(score, 3)}
+        if score > max_score:
+            updates[filename]['skipped'] = 'not seamless'
+            print(f"⚠️ Rejected {filename}: seam score {score:.2f} > {max_score}")
+    update_manifest_entries(raw_folder_path, updates)
+
+    rejected_count = sum(1 for update in updates.values() if update.get('skipped'))
+    print(f"✅ {len(scores) - rejected_count}/{len(scores)} images tile seamlessly")
+    return scores
+
+def _process_with_memory_budget(executor, input_paths, output_paths, profiles, budget_mb, use_cache=False,
+                                sources=None):
+    """Submit images to the pool without letting the estimated in-flight buffers exceed budget_mb.
+
+    An image larger than the whole budget is still processed, but only on its own.
+    Returns the results in input order and the largest estimated in-flight total.
+    """
+    results = [None] * len(input_paths)
+    in_flight = {}
+    in_flight_mb = 0
+    peak_in_flight_mb = 0
+
+    if sources is None:
+        sources = [None] * len(input_paths)
+
+    for idx, (input_path, image_output_paths) in enumerate(zip(input_paths, output_paths)):
+        try:
+            cost_mb = estimate_image_memory_mb(input_path, profiles, sources[idx])
+        except Exception:
+            # Unreadable header: let the worker report the real error, reserve full-size slots
+            cost_mb = sum(p['size'][0] * p['size'][1] * 4 for p in profiles) / (1024 * 1024)
+
+        while in_flight and in_flight_mb + cost_mb > budget_mb:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                done_idx, done_cost = in_flight.pop(future)
+                results[done_idx] = future.result()
+                in_flight_mb -= done_cost
+
+        future = executor.submit(
+            process_single_image, input_path, image_output_paths, profiles, True, use_cache, sources[idx]
+        )
+        in_flight[future] = (idx, cost_mb)
+        in_flight_mb += cost_mb
+        peak_in_flight_mb = max(peak_in_flight_mb, in_flight_mb)
+
+    for future, (done_idx, _) in in_flight.items():
+        results[done_idx] = future.result()
+
+    return results, peak_in_flight_mb
+
+def _process_serially(input_paths, output_paths, profiles, memory_bounded=False, use_cache=False, sources=None):
+    """Process images one at a time in this process. Returns the results in input order."""
+    if sources is None:
+        sources = [None] * len(input_paths)
+    results = []
+    for input_path, image_output_paths, source_bytes in zip(input_paths, output_paths, sources):
+        print(f"\nProcessing: {os.path.basename(input_path)}")
+        results.append(process_single_image(
+            input_path, image_output_paths, profiles, memory_bounded, use_cache, source_bytes
+        ))
+    return results
+
+def report_peak_memory(results, peak_in_flight_mb=None):
+    """Print peak memory for a processed product from the per-worker measurements"""
+    worker_peaks = {}
+    for result in results:
+        if result.get('peak_rss_mb') is not None:
+            worker_peaks[result['pid']] = max(worker_peaks.get(result['pid'], 0), result['peak_rss_mb'])
+
+    if worker_peaks:
+        print(f"📈 Peak memory: {max(worker_peaks.values()):.0f} MB per worker, "
+              f"{sum(worker_peaks.values()):.0f} MB across {len(worker_peaks)} worker(s)")
+    if peak_in_flight_mb is not None:
+        print(f"📈 Peak estimated image buffers in flight: {peak_in_flight_mb:.0f} MB")
+
+def process_images(raw_folder_path, target_folder, expected_count=None, workers=None,
+                   memory_budget_mb=None, use_cache=None, profiles=None, buffers=None):
+    """Process images in the raw folder with count verification.
+
+    Each image is decoded once and written in every profile of `profiles`
+    on `workers` processes. `buffers` maps raw filenames to bytes handed
+    over by the download stage. Arguments left as None take their settings
+    defaults. Returns one result dict per image, newest first.
+    """
     try:
         os.makedirs(target_folder, exist_ok=True)
-        
-        # Get list of image files sorted by creation time (newest first)
-        image_files = [f for f in os.listdir(raw_folder_path) 
-                      if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        image_files.sort(key=lambda x: os.path.getctime(os.path.join(raw_folder_path, x)), reverse=True)
-        
+
+        # Use the download manifest when there is one, it lists exactly this run's images
+        image_files = manifest_filenames(raw_folder_path)
+        if image_files is None:
+            # Get list of image files sorted by creation time (newest first)
+            image_files = [f for f in os.listdir(raw_folder_path)
+                          if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+            image_files.sort(key=lambda x: os.path.getctime(os.path.join(raw_folder_path, x)), reverse=True)
+
         # Take only the expected number of most recent images
         if expected_count:
             if len(image_files) < expected_count:
                 print(f"⚠️ Warning: Found fewer images ({len(image_files)}) than expected ({expected_count})")
             image_files = image_files[:expected_count]  # Take only the expected number of most recent images
-        
+
         if not image_files:
             print(f"⚠️ No images found in {raw_folder_path}")
-            return
-        
+            # An empty manifest, so the upload never falls back to an older run's outputs in this folder
+            write_manifest(target_folder, [], source_folder=raw_folder_path)
+            return []
+
+        if workers is None:
+            workers = IMAGE_PROCESS_WORKERS
+        if memory_budget_mb is None:
+            memory_budget_mb = IMAGE_PROCESS_MEMORY_BUDGET_MB
+        if use_cache is None:
+            use_cache = PROCESSED_CACHE_ENABLED
+        if profiles is None:
+            profiles = OUTPUT_PROFILES
+        # Largest first, so each profile can be derived from the one before it
+        profiles = sorted(profiles, key=lambda p: p['size'][0] * p['size'][1], reverse=True)
+        workers = max(1, min(workers, len(image_files)))
+
         print(f"\nProcessing {len(image_files)} images:")
         print(f"From: {raw_folder_path}")
         print(f"To: {target_folder}")
-        
-        processed_count = 0
-        for filename in image_files:
+        print(f"Profiles: {', '.join(p['name'] for p in profiles)}")
+        if workers > 1:
+            print(f"Using {workers} worker processes")
+        if memory_budget_mb:
+            print(f"Memory budget: {memory_budget_mb} MB")
+
+        input_paths = [os.path.join(raw_folder_path, f) for f in image_files]
+        output_paths = [[profile_output_path(target_folder, f, p) for p in profiles] for f in image_files]
+        sources = [buffers.get(f) if buffers else None for f in image_files]
+
+        peak_in_flight_mb = None
+        if workers == 1 and not memory_budget_mb:
+            results = _process_serially(input_paths, output_paths, profiles, use_cache=use_cache, sources=sources)
+        else:
             try:
-                input_path = os.path.join(raw_folder_path, filename)
-                output_path = os.path.join(target_folder, filename)
-                
-                print(f"\nProcessing: {filename}")
-                
-                # Process using PIL
-                with Image.open(input_path) as img:
-                    # Resize to 3600x3600 using Lanczos resampling
-                    img = img.resize((3600, 3600), Image.Resampling.LANCZOS)
-                    # Save with high quality and DPI settings
-                    img.save(
-                        output_path,
-                        quality=95,  # High quality for JPEGs
-                        dpi=(300, 300),  # Set DPI to 300
-                        optimize=True  # Enable optimization
-                    )
+                with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT) as executor:
+                    if memory_budget_mb:
+                        # Always use worker processes here so peak RSS is measured for this product only
+                        results, peak_in_flight_mb = _process_with_memory_budget(
+                            executor, input_paths, output_paths, profiles, memory_budget_mb, use_cache, sources
+                        )
+                    else:
+                        # map() yields results in submission order, whatever order workers finish in
+                        results = list(executor.map(
+                            process_single_image, input_paths, output_paths, [profiles] * len(input_paths),
+                            [False] * len(input_paths), [use_cache] * len(input_paths), sources
+                        ))
+            except BrokenProcessPool as e:
+                # A worker was killed, most likely for running out of memory, and took the pool's results with it
+                print(f"⚠️ A worker process died ({e}), processing the images one at a time instead")
+                logging.error(f"Worker pool broke while processing {raw_folder_path}, falling back to serial: {e}")
+                peak_in_flight_mb = None
+                results = _process_serially(
+                    input_paths, output_paths, profiles, bool(memory_budget_mb), use_cache, sources
+                )
+
+        processed_count = 0
+        cached_count = 0
+        for result in results:
+            if result['success']:
                 processed_count += 1
-                    
-            except Exception as e:
-                print(f"❌ Error processing {filename}: {e}")
-                logging.error(f"Error processing {filename}: {e}")
-                continue
-        
+                if result['cached']:
+                    cached_count += 1
+            else:
+                print(f"❌ Error processing {result['filename']}: {result['error']}")
+                logging.error(f"Error processing {result['filename']}: {result['error']}")
+
         print(f"\n✅ Processed {processed_count}/{expected_count if expected_count else len(image_files)} images")
-        
+
+        # Record what was produced so the upload doesn't have to rescan the folder
+        write_manifest(target_folder, [
+            {
+                'filename': os.path.basename(result['output_path']),
+                'source': result['filename'],
+                'size': os.path.getsize(result['output_path']),
+                'outputs': {
+                    name: os.path.relpath(path, target_folder)
+                    for name, path in result['outputs'].items()
+                }
+            }
+            for result in results if result['success']
+        ], source_folder=raw_folder_path)
+        if use_cache:
+            if cached_count:
+                print(f"♻️ Served {cached_count} images from the processed cache")
+            evict_cache()
+        if memory_budget_mb:
+            report_peak_memory(results, peak_in_flight_mb)
+        return results
+
     except Exception as e:
         print(f"❌ Error processing folder: {e}")
         logging.error(f"Error processing folder: {e}")
-        raise
\ No newline at end of file
+        raise
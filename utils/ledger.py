@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from config.settings import PRODUCT_LEDGER_DB
+
+# In order. A product resumes at the stage after the last one recorded.
+STAGES = ('submitted', 'generated', 'downloaded', 'processed', 'uploaded', 'recorded')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_key TEXT PRIMARY KEY,
+    product_name TEXT NOT NULL,
+    stage TEXT,
+    details TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS stage_history (
+    product_key TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    details TEXT NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stage_history_by_product ON stage_history (product_key);
+"""
+
+def product_key(product_name, prompts):
+    """Ledger key of a product. Editing its prompts makes it a new product."""
+    digest = hashlib.sha256(json.dumps([product_name, list(prompts)]).encode('utf-8')).hexdigest()
+    return digest[:20]
+
+def stage_reached(entry, stage):
+    """Whether a ledger entry has completed `stage`"""
+    if not entry or not entry['stage']:
+        return False
+    return STAGES.index(entry['stage']) >= STAGES.index(stage)
+
+class ProductLedger:
+    """SQLite record of how far each product got, so a restart resumes instead of starting over.
+
+    Each stage stores what the next stages need (job ids, folders, links)
+    in the entry's details. Writes are committed immediately. Safe to share
+    between threads.
+    """
+
+    def __init__(self, db_path=PRODUCT_LEDGER_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def get(self, key):
+        """A product's entry as {product_name, stage, details, error, updated_at}, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT product_name, stage, details, error, updated_at FROM products WHERE product_key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'product_name': row[0], 'stage': row[1], 'details': json.loads(row[2]),
+                'error': row[3], 'updated_at': row[4]}
+
+    def advance(self, key, product_name, stage, **details):
+        """Record that a product completed `stage`, merging `details` into what earlier stages stored"""
+        entry = self.get(key)
+        merged = dict(entry['details']) if entry else {}
+        merged.update(details)
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT INTO products (product_key, product_name, stage, details, error, updated_at) "
+                    "VALUES (?, ?, ?, ?, NULL, ?) "
+                    "ON CONFLICT(product_key) DO UPDATE SET stage = excluded.stage, details = excluded.details, "
+                    "error = NULL, updated_at = excluded.updated_at",
+                    (key, product_name, stage, json.dumps(merged), now)
+                )
+                self._connection.execute(
+                    "INSERT INTO stage_history (product_key, stage, details, recorded_at) VALUES (?, ?, ?, ?)",
+                    (key, stage, json.dumps(details), now)
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error recording stage {stage} of {product_name} in ledger: {e}")
+        return merged
+
+    def update(self, key, product_name, **details):
+        """Merge `details` into a product's entry without completing a stage, e.g. progress within one"""
+        entry = self.get(key)
+        merged = dict(entry['details']) if entry else {}
+        merged.update(details)
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT INTO products (product_key, product_name, details, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(product_key) DO UPDATE SET details = excluded.details, updated_at = excluded.updated_at",
+                    (key, product_name, json.dumps(merged), time.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error updating {product_name} in ledger: {e}")
+        return merged
+
+    def record_failure(self, key, product_name, error):
+        """Note why a product stopped, keeping the last stage it completed"""
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT INTO products (product_key, product_name, error, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(product_key) DO UPDATE SET error = excluded.error, updated_at = excluded.updated_at",
+                    (key, product_name, str(error), time.strftime("%Y-%m-%d %H:%M:%S"))
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error recording failure of {product_name} in ledger: {e}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+_shared_ledger = None
+_shared_ledger_lock = threading.Lock()
+
+def get_product_ledger():
+    """The ledger at PRODUCT_LEDGER_DB shared by the whole process, opened on first use"""
+    global _shared_ledger
+    with _shared_ledger_lock:
+        if _shared_ledger is None:
+            _shared_ledger = ProductLedger()
+        return _shared_ledger
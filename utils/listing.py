@@ -0,0 +1,165 @@
+from PIL import Image, ImageDraw, ImageFont
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config.settings import (
+    LISTING_IMAGES_FOLDER,
+    LISTING_SOURCE_PROFILE,
+    LISTING_IMAGE_SIZE,
+    LISTING_WATERMARK_TEXT,
+    LISTING_WORKERS
+)
+from utils.manifest import read_manifest
+
+# Spawned rather than forked, since listings are made on a finish thread of a multi-threaded process
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+GRID_GAP = 12
+GRID_BACKGROUND = (255, 255, 255)
+
+def _open_rgb(path, size):
+    """Open an image as RGB, decoding no larger than needed for `size`"""
+    with Image.open(path) as img:
+        img.draft('RGB', size)
+        return img.convert('RGB')
+
+def _fit(img, size):
+    """Center-crop to the target aspect ratio and resize"""
+    scale = max(size[0] / img.width, size[1] / img.height)
+    resized = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.LANCZOS)
+    left = (resized.width - size[0]) // 2
+    top = (resized.height - size[1]) // 2
+    return resized.crop((left, top, left + size[0], top + size[1]))
+
+def _load_font(size):
+    for name in ("DejaVuSans-Bold.ttf", "Arial Bold.ttf", "arialbd.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+def make_grid(paths, output_path, columns, size=LISTING_IMAGE_SIZE):
+    """Collage of the images in a columns x rows grid"""
+    rows = (len(paths) + columns - 1) // columns
+    cell = (
+        (size[0] - GRID_GAP * (columns + 1)) // columns,
+        (size[1] - GRID_GAP * (rows + 1)) // rows
+    )
+    canvas = Image.new('RGB', size, GRID_BACKGROUND)
+    for idx, path in enumerate(paths):
+        row, column = divmod(idx, columns)
+        tile = _fit(_open_rgb(path, cell), cell)
+        canvas.paste(tile, (GRID_GAP + column * (cell[0] + GRID_GAP), GRID_GAP + row * (cell[1] + GRID_GAP)))
+    canvas.save(output_path, quality=90, optimize=True)
+    return output_path
+
+def make_watermarked_preview(path, output_path, text=LISTING_WATERMARK_TEXT, size=LISTING_IMAGE_SIZE):
+    """The image with its watermark repeated diagonally across it"""
+    img = _fit(_open_rgb(path, size), size).convert('RGBA')
+    font = _load_font(size[0] // 20)
+    # Draw the text on a larger layer so the rotated pattern still covers the corners
+    layer = Image.new('RGBA', (size[0] * 2, size[1] * 2), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(layer)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    step_x = (right - left) + size[0] // 10
+    step_y = (bottom - top) * 4
+    for y in range(0, layer.height, step_y):
+        offset = (y // step_y % 2) * step_x // 2
+        for x in range(-step_x, layer.width, step_x):
+            draw.text((x + offset, y), text, font=font, fill=(255, 255, 255, 90))
+    layer = layer.rotate(30, resample=Image.Resampling.BICUBIC)
+    layer = layer.crop((size[0] // 2, size[1] // 2, size[0] // 2 + size[0], size[1] // 2 + size[1]))
+    Image.alpha_composite(img, layer).convert('RGB').save(output_path, quality=90, optimize=True)
+    return output_path
+
+def make_tiled_preview(path, output_path, repeats=3, size=LISTING_IMAGE_SIZE):
+    """The pattern repeated `repeats` x `repeats` times, showing how it tiles"""
+    tile_size = (size[0] // repeats, size[1] // repeats)
+    tile = _fit(_open_rgb(path, tile_size), tile_size)
+    canvas = Image.new('RGB', (tile_size[0] * repeats, tile_size[1] * repeats))
+    for row in range(repeats):
+        for column in range(repeats):
+            canvas.paste(tile, (column * tile_size[0], row * tile_size[1]))
+    canvas.save(output_path, quality=90, optimize=True)
+    return output_path
+
+def _run_job(job):
+    """Run one compositing job. Runs in a worker process."""
+    kind, args = job
+    try:
+        if kind == 'grid':
+            return make_grid(*args)
+        if kind == 'watermark':
+            return make_watermarked_preview(*args)
+        return make_tiled_preview(*args)
+    except Exception as e:
+        logging.error(f"Error creating listing image {args[1]}: {e}")
+        return None
+
+def listing_source_paths(target_folder, profile=LISTING_SOURCE_PROFILE):
+    """Downscaled outputs of a processed product, in manifest order"""
+    manifest = read_manifest(target_folder)
+    if manifest is None:
+        return []
+    paths = []
+    for entry in manifest.get('files', []):
+        relative_path = entry.get('outputs', {}).get(profile)
+        if not relative_path:
+            # Product processed without the listing profile, fall back to the master
+            relative_path = entry['filename']
+        path = os.path.join(target_folder, relative_path)
+        if os.path.isfile(path):
+            paths.append(path)
+    return paths
+
+def create_listing_images(target_folder, product_name, seamless=False, workers=None):
+    """Build grid collages, watermarked previews and, for seamless products, tiled previews.
+
+    Returns the listing images folder for the product, or None if there was
+    nothing to build from.
+    """
+    try:
+        paths = listing_source_paths(target_folder)
+        if not paths:
+            print(f"⚠️ No processed images to build listing images from in {target_folder}")
+            return None
+
+        listing_folder = os.path.join(LISTING_IMAGES_FOLDER, product_name)
+        os.makedirs(listing_folder, exist_ok=True)
+
+        jobs = [('grid', (paths[:9], os.path.join(listing_folder, "grid_cover.jpg"), 3))]
+        # One 2x2 grid per prompt, MidJourney returns 4 images each
+        for group_idx in range(0, len(paths), 4):
+            jobs.append(('grid', (paths[group_idx:group_idx + 4],
+                                  os.path.join(listing_folder, f"grid_{group_idx // 4 + 1:02d}.jpg"), 2)))
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            jobs.append(('watermark', (path, os.path.join(listing_folder, f"preview_{name}.jpg"))))
+            if seamless:
+                jobs.append(('tiled', (path, os.path.join(listing_folder, f"tiled_{name}.jpg"))))
+
+        if workers is None:
+            workers = LISTING_WORKERS
+        workers = max(1, min(workers, len(jobs)))
+
+        print(f"\n🖼️ Creating {len(jobs)} listing images in {listing_folder}")
+        if workers == 1:
+            outputs = [_run_job(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_POOL_CONTEXT) as executor:
+                outputs = list(executor.map(_run_job, jobs))
+
+        created_count = sum(1 for output in outputs if output)
+        print(f"✅ Created {created_count}/{len(jobs)} listing images")
+        return listing_folder
+
+    except Exception as e:
+        print(f"❌ Error creating listing images: {e}")
+        logging.error(f"Error creating listing images: {e}")
+        return None
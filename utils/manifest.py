@@ -0,0 +1,66 @@
+import os
+import json
+import time
+import logging
+
+MANIFEST_FILENAME = "manifest.json"
+
+def manifest_path(folder):
+    return os.path.join(folder, MANIFEST_FILENAME)
+
+def read_manifest(folder):
+    """Read a folder's manifest, or None if it has none or it can't be read"""
+    path = manifest_path(folder)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error reading manifest {path}: {e}")
+        return None
+
+def write_manifest(folder, files, **details):
+    """Write a folder's manifest. `files` is a list of entry dicts, newest first."""
+    manifest = {
+        'updated_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+        **details,
+        'files': files
+    }
+    path = manifest_path(folder)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    # Replace atomically so a crash never leaves a truncated manifest behind
+    os.replace(temp_path, path)
+    return manifest
+
+def update_manifest_entries(folder, updates):
+    """Merge fields into manifest entries. `updates` maps filename -> dict of fields."""
+    manifest = read_manifest(folder)
+    if manifest is None:
+        return None
+    for entry in manifest.get('files', []):
+        entry.update(updates.get(entry['filename'], {}))
+    details = {k: v for k, v in manifest.items() if k not in ('files', 'updated_at')}
+    return write_manifest(folder, manifest['files'], **details)
+
+def manifest_filenames(folder, include_skipped=False):
+    """Filenames listed in a folder's manifest that exist on disk, in manifest order.
+
+    Entries marked 'skipped' by an earlier check are left out unless
+    include_skipped is set. Returns None when the folder has no manifest, so
+    callers can fall back to scanning the folder.
+    """
+    manifest = read_manifest(folder)
+    if manifest is None:
+        return None
+    filenames = []
+    for entry in manifest.get('files', []):
+        if entry.get('skipped') and not include_skipped:
+            continue
+        if os.path.isfile(os.path.join(folder, entry['filename'])):
+            filenames.append(entry['filename'])
+        else:
+            print(f"⚠️ Missing file listed in manifest: {entry['filename']}")
+    return filenames
@@ -0,0 +1,103 @@
+import time
+import threading
+import weakref
+from config.settings import RATE_LIMITS
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate adapts to how the site responds (additive increase, multiplicative decrease).
+
+    acquire() blocks until the next action may start. Report how each action
+    went with success(), which raises the rate by `increase` up to
+    `max_rate`, or failure(), which cuts it by `decrease` down to `min_rate`
+    and empties the bucket so queued actions pause too. Rates are in actions
+    per second. Safe to share between threads.
+    """
+
+    def __init__(self, name, rate, min_rate, max_rate, burst=1, increase=None, decrease=0.5):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase if increase is not None else min_rate
+        self.decrease = decrease
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+        self.last_failure = None
+        self.waited = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """Wait for a token. Returns how long the caller waited, in seconds."""
+        with self._lock:
+            self._refill(time.monotonic())
+            # Take the token now, going into debt if needed, so concurrent callers queue up in order
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def success(self):
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def failure(self, reason=None):
+        with self._lock:
+            self.failures += 1
+            self.last_failure = reason
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0)
+
+    def stats(self):
+        """Current rate and counters, for logging"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'rate': self.rate,
+                'interval': 1 / self.rate,
+                'successes': self.successes,
+                'failures': self.failures,
+                'last_failure': self.last_failure,
+                'waited': self.waited
+            }
+
+    def __str__(self):
+        stats = self.stats()
+        return (f"{self.name}: {stats['rate']:.2f}/s "
+                f"({stats['successes']} ok, {stats['failures']} backed off)")
+
+_shared_limiters = {}
+_driver_limiters = weakref.WeakKeyDictionary()
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(name, driver=None):
+    """The limiter configured as RATE_LIMITS[name].
+
+    Pass the driver for limits that belong to one browser session and its
+    account, such as prompt submission. Without it the limiter is shared by
+    the whole process.
+    """
+    with _limiters_lock:
+        limiters = _shared_limiters if driver is None else _driver_limiters.setdefault(driver, {})
+        limiter = limiters.get(name)
+        if limiter is None:
+            limiter = limiters[name] = AdaptiveRateLimiter(name, **RATE_LIMITS[name])
+        return limiter
+
+def rate_limiters(driver=None):
+    """Every limiter created so far, the driver's own ones included when given"""
+    with _limiters_lock:
+        limiters = list(_shared_limiters.values())
+        if driver is not None:
+            limiters.extend(_driver_limiters.get(driver, {}).values())
+    return limiters